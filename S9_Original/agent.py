@@ -4,6 +4,7 @@ import asyncio
 import yaml
 from core.loop import AgentLoop
 from core.session import MultiMCP
+from modules.model_manager import ModelManager
 from core.context import MemoryItem, AgentContext
 import datetime
 from pathlib import Path
@@ -47,7 +48,10 @@ async def main():
                 if not current_session:
                     current_session = context.session_id
 
-                result = await agent.run()
+                try:
+                    result = await agent.run()
+                finally:
+                    context.memory.close()
 
                 if isinstance(result, dict):
                     answer = result["result"]
@@ -66,6 +70,9 @@ async def main():
                     break
     except KeyboardInterrupt:
         print("\n👋 Received exit signal. Shutting down...")
+    finally:
+        await multi_mcp.shutdown()
+        await ModelManager.aclose()
 
 if __name__ == "__main__":
     asyncio.run(main())
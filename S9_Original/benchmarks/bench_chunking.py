@@ -0,0 +1,94 @@
+# benchmarks/bench_chunking.py
+"""
+Chunking modes compared on the files in documents/: chunking time, time to index
+(chunk + embed), chunk sizes, and two label-free quality measures:
+
+  clean cuts  - share of chunk boundaries that fall on a markdown block boundary
+                rather than mid-paragraph, mid-list or mid-table (higher is better)
+  adj. sim    - mean cosine similarity of neighbouring chunks; lower means the
+                boundaries separate topics better
+
+Needs a running Ollama (embeddings; phi4 for --llm).
+
+    uv run benchmarks/bench_chunking.py --llm
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(ROOT))
+
+from markitdown import MarkItDown
+from chunker import split_blocks, adjacent_similarity
+import mcp_server_2 as server
+
+
+def load_markdown(path: Path, with_pdf: bool) -> str:
+    if path.suffix.lower() == ".pdf":
+        if not with_pdf:
+            return ""
+        import pymupdf4llm
+        return pymupdf4llm.to_markdown(str(path))  # no image captioning, so timings are chunking only
+    return MarkItDown().convert(str(path)).text_content
+
+
+def clean_cut_ratio(markdown: str, chunks: list[str]) -> float:
+    starts = {" ".join(b.text.split())[:40] for b in split_blocks(markdown)}
+    cuts = [" ".join(c.split())[:40] for c in chunks[1:]]
+    if not cuts:
+        return 1.0
+    return sum(any(s.startswith(cut[:20]) or cut.startswith(s[:20]) for s in starts) for cut in cuts) / len(cuts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm", action="store_true", help="include the phi4 semantic_merge mode (slow)")
+    parser.add_argument("--pdf", action="store_true", help="include PDFs")
+    args = parser.parse_args()
+
+    modes = ["markdown", "semantic"] + (["llm"] if args.llm else [])
+    totals = {mode: {"chunk": 0.0, "index": 0.0, "chunks": 0, "clean": [], "sim": []} for mode in modes}
+
+    print("| file | mode | chunks | avg words | chunk s | index s | clean cuts | adj. sim |")
+    print("|---|---|---|---|---|---|---|---|")
+    for path in sorted((ROOT / "documents").glob("*.*")):
+        try:
+            markdown = load_markdown(path, args.pdf)
+        except Exception as e:
+            print(f"skipping {path.name}: {e}", file=sys.stderr)
+            continue
+        if len(markdown.split()) < 10:
+            continue
+        for mode in modes:
+            start = time.perf_counter()
+            chunks = server.chunk_markdown(markdown, mode)
+            chunk_s = time.perf_counter() - start
+            vectors = server.get_embeddings(chunks)
+            index_s = time.perf_counter() - start
+            sims = adjacent_similarity(vectors)
+            clean = clean_cut_ratio(markdown, chunks)
+            sim = float(sims.mean()) if len(sims) else float("nan")
+            t = totals[mode]
+            t["chunk"] += chunk_s
+            t["index"] += index_s
+            t["chunks"] += len(chunks)
+            t["clean"].append(clean)
+            if len(sims):
+                t["sim"].append(sim)
+            avg = np.mean([len(c.split()) for c in chunks])
+            print(f"| {path.name} | {mode} | {len(chunks)} | {avg:.0f} | {chunk_s:.2f} | {index_s:.2f} | {clean:.2f} | {sim:.3f} |")
+
+    print("\n| mode | chunks | chunk s | index s | clean cuts | adj. sim |")
+    print("|---|---|---|---|---|---|")
+    for mode, t in totals.items():
+        print(f"| {mode} | {t['chunks']} | {t['chunk']:.2f} | {t['index']:.2f} | "
+              f"{np.mean(t['clean']):.2f} | {np.mean(t['sim']) if t['sim'] else float('nan'):.3f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# benchmarks/bench_index.py
+"""
+Recall vs latency of the ANN index types in index_factory, measured against exact flat search.
+
+Uses the stored document vectors (faiss_index/vectors.f32, or index.bin for an older index),
+augmented with jittered copies up to --size so the IVF types have enough data to train.
+
+    uv run benchmarks/bench_index.py --size 20000 --queries 200 --k 5
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+ROOT = Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(ROOT))
+
+from chunk_store import VectorStore
+from index_factory import index_config, build_index, search_params
+
+
+def load_vectors() -> np.ndarray:
+    store = VectorStore(ROOT / "faiss_index")
+    if len(store):
+        return store.matrix()
+    index = faiss.read_index(str(ROOT / "faiss_index" / "index.bin"))
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def unit(x: np.ndarray) -> np.ndarray:
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+
+def augment(base: np.ndarray, size: int, rng, noise: float = 0.05) -> np.ndarray:
+    """Jittered copies of the real vectors, so clusters keep the shape of the real corpus."""
+    base = unit(base)
+    picks = rng.integers(0, len(base), size)
+    return unit(base[picks] + noise * rng.standard_normal((size, base.shape[1])).astype(np.float32))
+
+
+def timed_search(index, queries, k, params):
+    start = time.perf_counter()
+    _, I = index.search(queries, k, params=params)
+    return I, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    real = load_vectors()
+    corpus = augment(real, args.size, rng)
+    queries = augment(real, args.queries, rng, noise=0.08)
+    print(f"{len(real)} stored vectors -> corpus {corpus.shape}, {len(queries)} queries, k={args.k}\n")
+
+    flat = build_index(corpus, index_config({"type": "flat"}))
+    truth, flat_ms = timed_search(flat, queries, args.k, None)
+
+    sweeps = {
+        "ivf_flat": [("nprobe", n) for n in (1, 4, 16, 64)],
+        "ivf_pq": [("nprobe", n) for n in (1, 4, 16, 64)],
+        "hnsw": [("ef_search", e) for e in (16, 32, 64, 128)],
+    }
+    print(f"| index | build s | knob | recall@{args.k} | ms/query | speedup |")
+    print("|---|---|---|---|---|---|")
+    print(f"| flat | - | - | 1.000 | {flat_ms:.3f} | 1.0x |")
+    for kind, knobs in sweeps.items():
+        config = index_config({"type": kind, "nlist": args.nlist, "min_train_vectors": 1})
+        start = time.perf_counter()
+        index = build_index(corpus, config)
+        build_s = time.perf_counter() - start
+        for name, value in knobs:
+            params = search_params(index, config, **{name: value})
+            found, ms = timed_search(index, queries, args.k, params)
+            print(f"| {kind} | {build_s:.2f} | {name}={value} | {recall(found, truth):.3f} | {ms:.3f} | {flat_ms / ms:.1f}x |")
+
+
+if __name__ == "__main__":
+    main()
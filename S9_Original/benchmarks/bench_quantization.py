@@ -0,0 +1,74 @@
+# benchmarks/bench_quantization.py
+"""
+Fidelity of the compressed index encodings against the flat L2 baseline that
+index.bin used before: recall@k of the baseline's neighbours, bytes per vector,
+serialized size (which is also the resident size) and query latency.
+
+Corpus and queries are built as in bench_index.py.
+
+    uv run benchmarks/bench_quantization.py --size 20000 --queries 200 --k 5
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+from bench_index import ROOT, load_vectors, augment, recall, timed_search
+from index_factory import index_config, build_index, search_params
+
+VARIANTS = [
+    {"type": "flat", "metric": "ip"},
+    {"type": "fp16", "metric": "l2"},
+    {"type": "sq8", "metric": "l2"},
+    {"type": "sq8", "metric": "ip"},
+    {"type": "pq", "metric": "l2", "pq_m": 96},
+    {"type": "pq", "metric": "l2", "pq_m": 48},
+    {"type": "pq", "metric": "l2", "pq_m": 16},
+    {"type": "ivf_sq8", "metric": "l2"},
+    {"type": "ivf_pq", "metric": "l2", "pq_m": 48},
+]
+
+
+def label(config: dict) -> str:
+    extra = f" m={config['pq_m']}" if config["type"].endswith("pq") else ""
+    return f"{config['type']}{extra} / {config['metric']}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    real = load_vectors()
+    corpus = augment(real, args.size, rng)
+    queries = augment(real, args.queries, rng, noise=0.08)
+    print(f"{len(real)} stored vectors -> corpus {corpus.shape}, {len(queries)} queries, k={args.k}\n")
+
+    baseline = build_index(corpus, index_config({"type": "flat"}))
+    truth, base_ms = timed_search(baseline, queries, args.k, None)
+    base_bytes = faiss.serialize_index(baseline).nbytes
+
+    print(f"| encoding / metric | recall@{args.k} | B/vector | index MiB | vs baseline | ms/query |")
+    print("|---|---|---|---|---|---|")
+    print(f"| flat / l2 (baseline) | 1.000 | {base_bytes / len(corpus):.0f} | {base_bytes / 2**20:.1f} | 1.00x | {base_ms:.3f} |")
+    for variant in VARIANTS:
+        config = index_config({**variant, "nlist": args.nlist, "min_train_vectors": 1})
+        index = build_index(corpus, config)
+        found, ms = timed_search(index, queries, args.k, search_params(index, config))
+        size = faiss.serialize_index(index).nbytes
+        print(f"| {label(config)} | {recall(found, truth):.3f} | {size / len(corpus):.0f} | {size / 2**20:.1f} | "
+              f"{size / base_bytes:.2f}x | {ms:.3f} |")
+
+
+if __name__ == "__main__":
+    main()
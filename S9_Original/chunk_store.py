@@ -0,0 +1,185 @@
+# chunk_store.py
+
+import os
+import json
+import mmap
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Iterable, List
+
+
+class ChunkStore:
+    """
+    Append-only chunk records addressed by FAISS row id.
+
+    <name>.bin holds the UTF-8 JSON records back to back; <name>.idx holds one
+    little-endian uint64 end offset per record. Both are memory-mapped, so opening
+    the store and reading any row is O(1) regardless of corpus size.
+    A record becomes visible only once its offset is written, so a crash mid-append
+    leaves at most unreferenced bytes that the next writer trims.
+    """
+
+    OFFSET_DTYPE = np.dtype("<u8")
+
+    def __init__(self, directory: Path, name: str = "chunks"):
+        self.blob_path = Path(directory) / f"{name}.bin"
+        self.idx_path = Path(directory) / f"{name}.idx"
+        self._lock = threading.RLock()
+        self._offsets = np.empty(0, dtype=self.OFFSET_DTYPE)
+        self._blob = None
+        self._blob_file = None
+        self._idx_size = -1
+
+    def exists(self) -> bool:
+        return self.idx_path.exists()
+
+    def _remap(self):
+        """(Re)map the files if they changed size since the last look."""
+        idx_size = self.idx_path.stat().st_size if self.idx_path.exists() else 0
+        if idx_size == self._idx_size:
+            return
+        self.close()
+        count = idx_size // self.OFFSET_DTYPE.itemsize
+        if count:
+            self._offsets = np.memmap(self.idx_path, dtype=self.OFFSET_DTYPE, mode="r", shape=(count,))
+            self._blob_file = open(self.blob_path, "rb")
+            self._blob = mmap.mmap(self._blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._idx_size = idx_size
+
+    def refresh(self):
+        with self._lock:
+            self._remap()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._remap()
+            return len(self._offsets)
+
+    def __getitem__(self, row: int) -> dict:
+        with self._lock:
+            if row >= len(self._offsets):
+                self._remap()
+            if not 0 <= row < len(self._offsets):
+                raise IndexError(f"chunk row {row} out of range ({len(self._offsets)} rows)")
+            start = int(self._offsets[row - 1]) if row else 0
+            return json.loads(self._blob[start:int(self._offsets[row])])
+
+    def get_many(self, rows: Iterable[int]) -> List[dict]:
+        return [self[int(row)] for row in rows]
+
+    def append(self, records: List[dict]) -> range:
+        """Append records and return their row ids."""
+        with self._lock:
+            self._remap()
+            first = len(self._offsets)
+            end = int(self._offsets[-1]) if first else 0
+            self._trim_to(first)
+
+            payloads = [json.dumps(record, ensure_ascii=False).encode("utf-8") for record in records]
+            ends = end + np.cumsum([len(p) for p in payloads], dtype=np.uint64)
+            self.blob_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.blob_path, "ab") as blob:
+                blob.write(b"".join(payloads))
+                blob.flush()
+                os.fsync(blob.fileno())
+            with open(self.idx_path, "ab") as idx:
+                idx.write(ends.astype(self.OFFSET_DTYPE).tobytes())
+                idx.flush()
+                os.fsync(idx.fileno())
+            self._remap()
+            return range(first, first + len(records))
+
+    def truncate(self, rows: int):
+        """Drop every record from row `rows` on (e.g. rows appended without a matching index write)."""
+        with self._lock:
+            self._remap()
+            if rows < len(self._offsets):
+                self._trim_to(rows)
+                self._remap()
+
+    def _trim_to(self, rows: int):
+        """Cut both files back to exactly `rows` records, discarding torn or orphaned tails."""
+        end = int(self._offsets[rows - 1]) if rows else 0
+        self.close()
+        self._idx_size = -1
+        for path, size in ((self.idx_path, rows * self.OFFSET_DTYPE.itemsize), (self.blob_path, end)):
+            if path.exists() and path.stat().st_size != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def close(self):
+        if self._blob is not None:
+            self._blob.close()
+            self._blob = None
+        if self._blob_file is not None:
+            self._blob_file.close()
+            self._blob_file = None
+        if isinstance(self._offsets, np.memmap):
+            self._offsets._mmap.close()
+        self._offsets = np.empty(0, dtype=self.OFFSET_DTYPE)
+
+
+class VectorStore:
+    """
+    Append-only float32 matrix (<name>.f32), row-aligned with ChunkStore.
+    Keeps the exact embeddings so any index type can be (re)trained or rebuilt
+    without re-embedding; read through a memory map.
+    """
+
+    def __init__(self, directory: Path, name: str = "vectors", dim: int = None):
+        self.path = Path(directory) / f"{name}.f32"
+        self.meta_path = Path(directory) / f"{name}.json"
+        self.dim = dim
+        if self.dim is None and self.meta_path.exists():
+            self.dim = json.loads(self.meta_path.read_text())["dim"]
+
+    def __len__(self) -> int:
+        if self.dim is None or not self.path.exists():
+            return 0
+        return self.path.stat().st_size // (4 * self.dim)
+
+    def matrix(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """Rows [start, stop) as an in-memory float32 array."""
+        rows = len(self)
+        stop = rows if stop is None else min(stop, rows)
+        if stop <= start:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        mapped = np.memmap(self.path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        try:
+            return np.array(mapped[start:stop])
+        finally:
+            mapped._mmap.close()
+
+    def take(self, rows) -> np.ndarray:
+        """The given rows, in the given order."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        mapped = np.memmap(self.path, dtype=np.float32, mode="r", shape=(len(self), self.dim))
+        try:
+            return np.array(mapped[rows])
+        finally:
+            mapped._mmap.close()
+
+    def append(self, vectors: np.ndarray) -> range:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.meta_path.write_text(json.dumps({"dim": self.dim}))
+        first = len(self)
+        self.truncate(first)  # drop a torn partial row
+        with open(self.path, "ab") as f:
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        return range(first, first + len(vectors))
+
+    def truncate(self, rows: int):
+        if self.dim is None or not self.path.exists():
+            return
+        size = rows * 4 * self.dim
+        if self.path.stat().st_size > size:
+            with open(self.path, "r+b") as f:
+                f.truncate(size)
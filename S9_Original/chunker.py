@@ -0,0 +1,194 @@
+# chunker.py
+
+import re
+import numpy as np
+from typing import Callable, List, Optional
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+\S")
+LIST_RE = re.compile(r"^\s*([-*+]|\d+[.)])\s+")
+TABLE_RE = re.compile(r"^\s*\|")
+FENCE_RE = re.compile(r"^\s*(```|~~~)")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+CHUNK_MODES = ("llm", "markdown", "semantic")
+
+
+class Block:
+    """A structural unit of a markdown document: heading, paragraph, list, table or code block."""
+
+    __slots__ = ("kind", "text", "level")
+
+    def __init__(self, kind: str, text: str, level: int = 0):
+        self.kind = kind
+        self.text = text
+        self.level = level  # heading level, 0 for everything else
+
+    @property
+    def words(self) -> int:
+        return len(self.text.split())
+
+
+def _line_kind(line: str) -> str:
+    if LIST_RE.match(line):
+        return "list"
+    if TABLE_RE.match(line):
+        return "table"
+    return "paragraph"
+
+
+def split_blocks(markdown: str) -> List[Block]:
+    """
+    Split markdown into blocks without breaking tables, lists or fenced code.
+    A list item's indented continuation lines stay with the list.
+    """
+    blocks, current, kind, in_fence = [], [], None, False
+
+    def flush():
+        nonlocal current, kind
+        if current:
+            blocks.append(Block(kind, "\n".join(current).strip()))
+        current, kind = [], None
+
+    for line in markdown.splitlines():
+        if in_fence:
+            current.append(line)
+            if FENCE_RE.match(line):
+                in_fence = False
+                flush()
+            continue
+        if FENCE_RE.match(line):
+            flush()
+            current, kind, in_fence = [line], "code", True
+            continue
+        if not line.strip():
+            if kind != "list":  # lists may have blank lines between items
+                flush()
+            continue
+        heading = HEADING_RE.match(line)
+        if heading:
+            flush()
+            blocks.append(Block("heading", line.strip(), len(heading.group(1))))
+            continue
+        line_kind = _line_kind(line)
+        if kind == "list" and line_kind == "paragraph" and line[:1].isspace():
+            line_kind = "list"  # indented continuation of an item
+        if line_kind != kind:
+            flush()
+            kind = line_kind
+        current.append(line)
+    flush()
+    return [b for b in blocks if b.text]
+
+
+def _split_long(block: Block, max_words: int) -> List[Block]:
+    """Break an oversized block at sentence (or, failing that, line/word) boundaries."""
+    if block.words <= max_words:
+        return [block]
+    sep = "\n" if block.kind in ("list", "table", "code") else " "
+    pieces = block.text.split("\n") if sep == "\n" else SENTENCE_RE.split(block.text)
+    out, current = [], []
+    for piece in pieces:
+        words = piece.split()
+        if len(words) > max_words:  # a single run-on sentence/line: emit full pieces, keep the rest
+            if current:
+                out.append(sep.join(current))
+                current = []
+            while len(words) > max_words:
+                out.append(" ".join(words[:max_words]))
+                words = words[max_words:]
+            piece = " ".join(words)
+        elif sep == " ":
+            piece = " ".join(words)
+        if current and len(" ".join(current).split()) + len(words) > max_words:
+            out.append(sep.join(current))
+            current = []
+        if words:
+            current.append(piece)
+    if current:
+        out.append(sep.join(current))
+    return [Block(block.kind, text) for text in out]
+
+
+def markdown_units(markdown: str, max_words: int) -> List[Block]:
+    """Blocks with each heading folded into the block after it, no unit longer than max_words."""
+    units, heading = [], None
+    for block in split_blocks(markdown):
+        if block.kind == "heading":
+            if heading is not None:
+                units.append(heading)  # heading with no body before the next heading
+            heading = block
+            continue
+        for i, piece in enumerate(_split_long(block, max_words)):
+            if i == 0 and heading is not None:
+                piece = Block(piece.kind, f"{heading.text}\n\n{piece.text}", heading.level)
+                heading = None
+            units.append(piece)
+    if heading is not None:
+        units.append(heading)
+    return units
+
+
+def adjacent_similarity(vectors: np.ndarray) -> np.ndarray:
+    """Cosine similarity between each row and the next, in one vectorized pass."""
+    if len(vectors) < 2:
+        return np.empty(0, dtype=np.float32)
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return np.einsum("ij,ij->i", unit[:-1], unit[1:])
+
+
+def _pack(units: List[Block], breaks: np.ndarray, max_words: int, min_words: int) -> List[str]:
+    """Greedy packing: start a new chunk at a break once the current one has min_words, or when full."""
+    chunks, current, count = [], [], 0
+    for i, unit in enumerate(units):
+        boundary = i > 0 and breaks[i - 1]
+        if current and ((boundary and count >= min_words) or count + unit.words > max_words):
+            chunks.append("\n\n".join(current))
+            current, count = [], 0
+        current.append(unit.text)
+        count += unit.words
+    if current:
+        if chunks and count < min_words and len(chunks[-1].split()) + count <= max_words:
+            chunks[-1] += "\n\n" + "\n\n".join(current)  # don't leave a runt at the end
+        else:
+            chunks.append("\n\n".join(current))
+    return chunks
+
+
+def markdown_chunks(markdown: str, max_words: int = 400, min_words: int = 40, heading_level: int = 2) -> List[str]:
+    """Structure-only chunking: break at headings up to `heading_level`, pack blocks up to max_words."""
+    units = markdown_units(markdown, max_words)
+    breaks = np.array([0 < u.level <= heading_level for u in units[1:]], dtype=bool)
+    return _pack(units, breaks, max_words, min_words)
+
+
+def semantic_chunks(markdown: str, embed: Callable[[List[str]], np.ndarray], max_words: int = 400,
+                    min_words: int = 40, heading_level: int = 2, breakpoint_percentile: float = 25.0) -> List[str]:
+    """
+    Structure plus topic shifts: every unit is embedded in one `embed` call, and a break is
+    placed wherever the similarity to the previous unit falls in the lowest
+    `breakpoint_percentile` of the document (as well as at headings up to `heading_level`).
+    """
+    units = markdown_units(markdown, max_words)
+    vectors = embed([u.text for u in units]) if len(units) >= 3 else None
+    return semantic_pack(units, vectors, max_words, min_words, heading_level, breakpoint_percentile)
+
+
+def semantic_pack(units: List[Block], vectors: Optional[np.ndarray], max_words: int = 400, min_words: int = 40,
+                  heading_level: int = 2, breakpoint_percentile: float = 25.0) -> List[str]:
+    """The packing half of semantic_chunks, for callers that embed the units themselves (None below 3 units)."""
+    if len(units) < 3:
+        return _pack(units, np.zeros(max(len(units) - 1, 0), dtype=bool), max_words, min_words)
+    sims = adjacent_similarity(np.asarray(vectors, dtype=np.float32))
+    breaks = sims < np.percentile(sims, breakpoint_percentile)
+    breaks |= np.array([0 < u.level <= heading_level for u in units[1:]], dtype=bool)
+    return _pack(units, breaks, max_words, min_words)
+
+
+def chunk_mode_for(filename: str, config: Optional[dict]) -> str:
+    """Chunking mode for a file: rag.chunking.by_extension[.ext], else rag.chunking.mode."""
+    config = config or {}
+    ext = "." + filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    mode = (config.get("by_extension") or {}).get(ext, config.get("mode", "llm"))
+    if mode not in CHUNK_MODES:
+        raise ValueError(f"Unknown chunking mode '{mode}', expected one of {CHUNK_MODES}")
+    return mode
@@ -24,6 +24,25 @@ class AgentLoop:
         self.context = context
         self.mcp = self.context.dispatcher
         self.model = ModelManager()
+        self._perception_cache = {}  # (effective input, server descriptions) -> PerceptionResult
+
+    async def _perceive(self, user_input: str):
+        """
+        Run perception once per distinct input within this run; lifeline retries reuse it.
+        A fallback perception (the LLM call failed) is not kept, so the next attempt retries.
+        """
+        servers = self.context.mcp_server_descriptions or {}
+        key = (
+            user_input,
+            tuple(sorted((sid, info.get("description", "")) for sid, info in servers.items())),
+        )
+        if key in self._perception_cache:
+            log("loop", "♻️ Reusing perception for unchanged input")
+            return self._perception_cache[key]
+        perception = await run_perception(context=self.context, user_input=user_input)
+        if not perception.fallback:
+            self._perception_cache[key] = perception
+        return perception
 
     async def run(self):
         max_steps = self.context.agent_profile.strategy.max_steps
@@ -36,7 +55,7 @@ class AgentLoop:
             while lifelines_left >= 0:
                 # === Perception ===
                 user_input_override = getattr(self.context, "user_input_override", None)
-                perception = await run_perception(context=self.context, user_input=user_input_override or self.context.user_input)
+                perception = await self._perceive(user_input_override or self.context.user_input)
 
                 print(f"[perception] {perception}")
 
@@ -61,6 +80,9 @@ class AgentLoop:
                     prompt_path=prompt_path,
                     step_num=step + 1,
                     max_steps=max_steps,
+                    # Later steps build the same prompt as step 1, so only step 1 may use the plan cache
+                    use_cache=step == 0,
+                    refresh_cache=lifelines_left < self.context.agent_profile.strategy.max_lifelines_per_step,
                 )
                 print(f"[plan] {plan}")
 
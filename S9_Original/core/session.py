@@ -1,10 +1,19 @@
 # core/session.py
 
 import os
+import ast
 import sys
-from typing import Optional, Any, List, Dict
+import json
+import time
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import Optional, Any, List, Dict, Callable, Awaitable
+import anyio
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
+from mcp.shared.exceptions import McpError
+from mcp.types import Tool, CONNECTION_CLOSED
 
 
 class MCP:
@@ -48,67 +57,378 @@ class MCP:
                 return await session.call_tool(tool_name, arguments=arguments)
 
 
+DEFAULT_POOL_SIZE = 1          # worker sessions per server
+DEFAULT_IDLE_TIMEOUT = 300.0   # seconds before an idle worker is shut down
+MAX_CALL_RETRIES = 1           # respawn-and-retry attempts for calls whose worker died before running them
+DEFAULT_DISCOVERY_TIMEOUT = 30.0  # seconds allowed per server for startup + list_tools
+MANIFEST_CACHE_PATH = Path(__file__).parent.parent / "cache" / "tool_manifest.json"
+
+
+class WorkerCrashed(RuntimeError):
+    """
+    Raised into a pending call when the worker session serving it died.
+    `reached_session` is False when the call never ran (the worker failed to spawn or
+    initialize), so retrying it can't repeat a tool's side effects.
+    """
+
+    def __init__(self, message: str, reached_session: bool = True):
+        super().__init__(message)
+        self.reached_session = reached_session
+
+
+def local_sources(script: Path) -> List[Path]:
+    """
+    The script and every module it imports, directly or through other local modules, from
+    its own directory (e.g. models.py, whose schemas become the tools' input/output schemas).
+    """
+    root = script.parent
+    seen, queue = {script.resolve()}, [script]
+    while queue:
+        try:
+            tree = ast.parse(queue.pop().read_bytes())
+        except (OSError, SyntaxError, ValueError):
+            continue
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module] + [f"{node.module}.{alias.name}" for alias in node.names]
+            else:
+                continue
+            for name in names:
+                base = root.joinpath(*name.split("."))
+                for candidate in (base.with_suffix(".py"), base / "__init__.py"):
+                    if candidate.exists() and candidate.resolve() not in seen:
+                        seen.add(candidate.resolve())
+                        queue.append(candidate)
+    return sorted(seen)
+
+
+def _is_transport_error(e: BaseException) -> bool:
+    """True if `e` means the session itself is gone (server exited, pipe closed), not that one call failed."""
+    if isinstance(e, McpError):
+        return e.error.code == CONNECTION_CLOSED
+    return isinstance(e, (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream, ConnectionError))
+
+
+class ServerSessionPool:
+    """
+    Long-lived stdio sessions for one MCP server.
+    Workers are spawned lazily (up to `size`), share one job queue, exit after
+    `idle_timeout` seconds without work, and are respawned when a call finds
+    its worker dead.
+    """
+
+    def __init__(self, config: dict, size: int = DEFAULT_POOL_SIZE, idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        self.config = config
+        self.size = max(1, int(size))
+        self.idle_timeout = idle_timeout
+        self._jobs: asyncio.Queue = asyncio.Queue()
+        self._workers: set = set()
+        self._idle = 0      # workers blocked on the job queue
+        self._starting = 0  # workers still spawning / initializing
+        self._closed = False
+
+    def _params(self) -> StdioServerParameters:
+        return StdioServerParameters(
+            command=self.config.get("command", sys.executable),
+            args=[self.config["script"]],
+            cwd=self.config.get("cwd", os.getcwd())
+        )
+
+    def _maybe_spawn(self):
+        if self._closed or len(self._workers) >= self.size:
+            return
+        if self._jobs.qsize() > self._idle + self._starting:
+            self._starting += 1
+            task = asyncio.create_task(self._worker())
+            self._workers.add(task)
+            task.add_done_callback(self._workers.discard)
+
+    async def run(self, op: Callable[[ClientSession], Awaitable[Any]]) -> Any:
+        """
+        Run `op(session)` on a pooled session. A call whose worker failed before running it is
+        retried on a fresh worker; one that was running when its worker died is not, since
+        tool calls may have side effects and the call itself may be what crashed the server.
+        """
+        if self._closed:
+            raise RuntimeError(f"Session pool for '{self.config['id']}' is shut down.")
+
+        for attempt in range(MAX_CALL_RETRIES + 1):
+            fut = asyncio.get_running_loop().create_future()
+            self._jobs.put_nowait((op, fut))
+            self._maybe_spawn()
+            try:
+                return await fut
+            except WorkerCrashed as e:
+                if e.reached_session or attempt >= MAX_CALL_RETRIES:
+                    raise RuntimeError(str(e)) from e.__cause__
+                print(f"⚠️ [{self.config['id']}] {e} — respawning and retrying...")
+
+    async def _worker(self):
+        job = None
+        ready = False
+        in_call = False  # job's op is running on the session
+        try:
+            started = time.perf_counter()
+            async with stdio_client(self._params()) as (read, write):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    ready = True
+                    self._starting -= 1
+                    print(f"→ [{self.config['id']}] worker session ready in {time.perf_counter() - started:.2f}s")
+
+                    while True:
+                        self._idle += 1
+                        try:
+                            job = await asyncio.wait_for(self._jobs.get(), timeout=self.idle_timeout)
+                        except asyncio.TimeoutError:
+                            print(f"→ [{self.config['id']}] idle worker evicted after {self.idle_timeout:g}s")
+                            return
+                        finally:
+                            self._idle -= 1
+
+                        if job is None:  # shutdown sentinel
+                            return
+                        op, fut = job
+                        if fut.done():  # caller went away
+                            job = None
+                            continue
+                        in_call = True
+                        try:
+                            result = await op(session)
+                        except Exception as e:
+                            if _is_transport_error(e):
+                                raise
+                            # The call failed, not the server: report it and keep the session warm.
+                            if not fut.done():
+                                fut.set_exception(e)
+                        else:
+                            if not fut.done():
+                                fut.set_result(result)
+                        job, in_call = None, False
+        except Exception as e:
+            stage = "crashed" if ready else "failed to start"
+            if job is None and not ready:
+                # Fail one waiting call so a broken server can't hang its callers.
+                try:
+                    job = self._jobs.get_nowait()
+                except asyncio.QueueEmpty:
+                    job = None
+            if job is not None:
+                _, fut = job
+                if not fut.done():
+                    crash = WorkerCrashed(f"MCP server '{self.config['id']}' {stage}: {e}", reached_session=in_call)
+                    crash.__cause__ = e
+                    fut.set_exception(crash)
+            else:
+                print(f"❌ [{self.config['id']}] worker {stage}: {e}")
+        finally:
+            if job is not None and not job[1].done():
+                job[1].set_exception(WorkerCrashed(f"MCP server '{self.config['id']}' worker was stopped",
+                                                   reached_session=in_call))
+            if not ready:
+                self._starting -= 1
+            self._workers.discard(asyncio.current_task())
+            if not self._jobs.empty():
+                self._maybe_spawn()
+
+    async def shutdown(self, timeout: float = 5.0):
+        self._closed = True
+        workers = list(self._workers)
+        for _ in workers:
+            self._jobs.put_nowait(None)
+        if workers:
+            _, pending = await asyncio.wait(workers, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
 class MultiMCP:
     """
-    Stateless version: discovers tools from multiple MCP servers, but reconnects per tool call.
-    Each call_tool() uses a fresh session based on tool-to-server mapping.
+    Discovers tools from multiple MCP servers and routes call_tool() through a
+    persistent session pool per server (keyed by server `id`), so tool calls
+    reuse warm server processes instead of spawning one per call.
     """
 
-    def __init__(self, server_configs: List[dict]):
+    def __init__(self, server_configs: List[dict], manifest_path: Optional[Path] = MANIFEST_CACHE_PATH):
         self.server_configs = server_configs
         self.tool_map: Dict[str, Dict[str, Any]] = {}  # tool_name → {config, tool}
         self.server_tools: Dict[str, List[Any]] = {}  # server_name -> list of tools
+        self.pools: Dict[str, ServerSessionPool] = {}  # server_id -> session pool
+        self.server_timings: Dict[str, Dict[str, Any]] = {}  # server_id -> discovery status/timing
+        self.manifest_path = Path(manifest_path) if manifest_path else None  # None disables the cache
+        self.manifest: Dict[str, Dict[str, Any]] = {}  # server_id -> {key, tools}
+        self._refresh_tasks: set = set()
+
+    def get_pool(self, config: dict) -> ServerSessionPool:
+        pool = self.pools.get(config["id"])
+        if pool is None:
+            pool = ServerSessionPool(
+                config,
+                size=config.get("pool_size", DEFAULT_POOL_SIZE),
+                idle_timeout=config.get("idle_timeout", DEFAULT_IDLE_TIMEOUT),
+            )
+            self.pools[config["id"]] = pool
+        return pool
 
 
     async def initialize(self):
+        """
+        Load tools for every server. Servers whose script and interpreter match the
+        manifest cache are not started at all; servers with a stale entry use it
+        immediately and are re-scanned in the background; the rest are scanned now.
+        """
         print("in MultiMCP initialize")
+        started = time.perf_counter()
+        self.manifest = self._load_manifest()
+
+        tools_by_server: Dict[str, List[Any]] = {}
+        to_scan, to_refresh = [], []
         for config in self.server_configs:
-            try:
-                params = StdioServerParameters(
-                    command=sys.executable,
-                    args=[config["script"]],
-                    cwd=config.get("cwd", os.getcwd())
-                )
-                print(f"→ Scanning tools from: {config['script']} in {params.cwd}")
-                async with stdio_client(params) as (read, write):
-                    print("Connection established, creating session...")
-                    try:
-                        async with ClientSession(read, write) as session:
-                            print("[agent] Session created, initializing...")
-                            await session.initialize()
-                            print("[agent] MCP session initialized")
-                            tools = await session.list_tools()
-                            print(f"→ Tools received: {[tool.name for tool in tools.tools]}")
-                            for tool in tools.tools:
-                                self.tool_map[tool.name] = {
-                                    "config": config,
-                                    "tool": tool
-                                }
-                                server_key = config["id"]  # fallback to script name if no key
-                                if server_key not in self.server_tools:
-                                    self.server_tools[server_key] = []
-                                self.server_tools[server_key].append(tool)
-                    except Exception as se:
-                        print(f"❌ Session error: {se}")
-            except Exception as e:
-                print(f"❌ Error initializing MCP server {config['script']}: {e}")
+            entry = self.manifest.get(config["id"])
+            key = self._manifest_key(config)
+            if not entry:
+                to_scan.append(config)
+                continue
+            tools_by_server[config["id"]] = [Tool.model_validate(t) for t in entry["tools"]]
+            fresh = key is not None and entry.get("key") == key
+            self.server_timings[config["id"]] = {
+                "status": "cached" if fresh else "stale",
+                "seconds": 0.0,
+                "tools": len(entry["tools"]),
+                "error": None,
+            }
+            if not fresh:
+                to_refresh.append(config)
+
+        results = await asyncio.gather(*(self._discover(config) for config in to_scan))
+        for config, tools in zip(to_scan, results):
+            if tools:
+                tools_by_server[config["id"]] = tools
+                self._update_manifest(config, tools)
+        if to_scan:
+            self._save_manifest()
+
+        # Register in config order so tool-name collisions resolve as before (last server wins)
+        for config in self.server_configs:
+            if tools_by_server.get(config["id"]):
+                self._register_tools(config, tools_by_server[config["id"]])
+
+        for config in to_refresh:
+            task = asyncio.create_task(self._refresh(config))
+            self._refresh_tasks.add(task)
+            task.add_done_callback(self._refresh_tasks.discard)
+
+        failed = [sid for sid, t in self.server_timings.items() if t["status"] in ("error", "timeout")]
+        cached = [sid for sid, t in self.server_timings.items() if t["status"] in ("cached", "stale")]
+        print(f"→ Discovery finished in {time.perf_counter() - started:.2f}s: "
+              f"{len(self.server_configs) - len(failed)}/{len(self.server_configs)} servers "
+              f"({len(cached)} from cache), {len(self.tool_map)} tools")
+        for sid in failed:
+            t = self.server_timings[sid]
+            print(f"⚠️ Server '{sid}' unavailable ({t['status']} after {t['seconds']:.2f}s): {t['error']}")
+        if to_refresh:
+            print(f"→ Refreshing stale tool manifests in background: {[c['id'] for c in to_refresh]}")
+
+    async def _refresh(self, config: dict):
+        tools = await self._discover(config)
+        if tools:
+            self._register_tools(config, tools)
+            self._update_manifest(config, tools)
+            self._save_manifest()
+
+    async def _discover(self, config: dict) -> List[Any]:
+        """Scan one server's tools on its session pool, bounded by a per-server timeout."""
+        server_id = config["id"]
+        timeout = config.get("discovery_timeout", DEFAULT_DISCOVERY_TIMEOUT)
+        pool = self.get_pool(config)
+        print(f"→ Scanning tools from: {config['script']} in {config.get('cwd', os.getcwd())}")
+        started = time.perf_counter()
+        tools, status, error = [], "ok", None
+        try:
+            result = await asyncio.wait_for(pool.run(lambda session: session.list_tools()), timeout)
+            tools = result.tools
+            print(f"→ [{server_id}] Tools received: {[tool.name for tool in tools]}")
+        except asyncio.TimeoutError:
+            status, error = "timeout", f"no response within {timeout}s"
+            # Don't keep a hung server process around; a later call can respawn it.
+            self.pools.pop(server_id, None)
+            await pool.shutdown(timeout=0)
+        except Exception as e:
+            status, error = "error", str(e)
+        self.server_timings[server_id] = {
+            "status": status,
+            "seconds": time.perf_counter() - started,
+            "tools": len(tools),
+            "error": error,
+        }
+        return tools
+
+    def _register_tools(self, config: dict, tools: List[Any]):
+        server_key = config["id"]
+        for name in [t.name for t in self.server_tools.get(server_key, [])]:
+            if self.tool_map.get(name, {}).get("config") is config:
+                del self.tool_map[name]
+        self.server_tools[server_key] = []
+        for tool in tools:
+            self.tool_map[tool.name] = {
+                "config": config,
+                "tool": tool
+            }
+            self.server_tools[server_key].append(tool)
+
+    # === Tool manifest cache ===
+
+    def _manifest_key(self, config: dict) -> Optional[str]:
+        """Content hash of the server script and its local imports, plus the interpreter that runs it."""
+        script = Path(config.get("cwd", os.getcwd())) / config["script"]
+        if not script.exists():
+            script = Path(config["script"])
+        if not script.exists():
+            return None
+        digest = hashlib.sha256()
+        for source in local_sources(script):
+            digest.update(source.name.encode("utf-8") + b"\0" + source.read_bytes())
+        return f"{config.get('command', sys.executable)}:{digest.hexdigest()}"
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        if not self.manifest_path or not self.manifest_path.exists():
+            return {}
+        try:
+            return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable tool manifest {self.manifest_path}: {e}")
+            return {}
+
+    def _update_manifest(self, config: dict, tools: List[Any]):
+        key = self._manifest_key(config)
+        if key is None:
+            return
+        self.manifest[config["id"]] = {
+            "key": key,
+            "tools": [tool.model_dump(mode="json") for tool in tools],
+        }
+
+    def _save_manifest(self):
+        if not self.manifest_path:
+            return
+        try:
+            self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.manifest_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.manifest, indent=2), encoding="utf-8")
+            os.replace(tmp, self.manifest_path)
+        except Exception as e:
+            print(f"⚠️ Could not write tool manifest {self.manifest_path}: {e}")
 
     async def call_tool(self, tool_name: str, arguments: dict) -> Any:
         entry = self.tool_map.get(tool_name)
         if not entry:
             raise ValueError(f"Tool '{tool_name}' not found on any server.")
 
-        config = entry["config"]
-        params = StdioServerParameters(
-            command=sys.executable,
-            args=[config["script"]],
-            cwd=config.get("cwd", os.getcwd())
-        )
-
-        async with stdio_client(params) as (read, write):
-            async with ClientSession(read, write) as session:
-                await session.initialize()
-                return await session.call_tool(tool_name, arguments)
+        pool = self.get_pool(entry["config"])
+        return await pool.run(lambda session: session.call_tool(tool_name, arguments))
 
     async def list_all_tools(self) -> List[str]:
         return list(self.tool_map.keys())
@@ -126,4 +446,8 @@ class MultiMCP:
 
 
     async def shutdown(self):
-        pass  # no persistent sessions to close
\ No newline at end of file
+        for task in list(self._refresh_tasks):
+            task.cancel()
+        await asyncio.gather(*self._refresh_tasks, return_exceptions=True)
+        await asyncio.gather(*(pool.shutdown() for pool in self.pools.values()))
+        self.pools.clear()
\ No newline at end of file
@@ -0,0 +1,70 @@
+# extractor.py
+
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+import pymupdf4llm
+import trafilatura
+from markitdown import MarkItDown
+
+DOC_PATH = Path(__file__).parent.resolve() / "documents"
+IMAGE_DIR = DOC_PATH / "images"  # PDF images, linked from the markdown as images/<name>
+CAPTIONED_TYPES = (".pdf", ".html", ".htm", ".url")  # their image links are replaced by captions
+
+
+def log(level: str, message: str) -> None:
+    sys.stderr.write(f"{level}: {message}\n")
+    sys.stderr.flush()
+
+
+def pdf_markdown(path: str) -> str:
+    """PDF -> markdown, writing its images to documents/images/."""
+    IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+    markdown = pymupdf4llm.to_markdown(path, write_images=True, image_path=str(IMAGE_DIR))
+    # Re-point image links in the markdown
+    return re.sub(r'!\[\]\((.*?/images/)([^)]+)\)', r'![](images/\2)', markdown.replace("\\", "/"))
+
+
+def webpage_markdown(url: str) -> Optional[str]:
+    """Main content of a web page as markdown, without ads and clutter; None if it could not be downloaded."""
+    downloaded = trafilatura.fetch_url(url)
+    if not downloaded:
+        return None
+    return trafilatura.extract(
+        downloaded,
+        include_comments=False,
+        include_tables=True,
+        include_images=True,
+        output_format='markdown'
+    ) or ""
+
+
+def extract_markdown(path: str) -> dict:
+    """
+    Ingestion stage 1, run in a worker process: file -> markdown, with image links left in
+    place. Captioning, chunking and embedding call Ollama, so they run in the server process
+    where one set of request caps covers every file. This module keeps no state, so a
+    worker only pays for its imports.
+    """
+    file = Path(path)
+    start = time.perf_counter()
+    ext = file.suffix.lower()
+
+    if ext == ".pdf":
+        log("INFO", f"Using MuPDF4LLM to extract {file.name}")
+        markdown = pdf_markdown(str(file))
+
+    elif ext in [".html", ".htm", ".url"]:
+        log("INFO", f"Using Trafilatura to extract {file.name}")
+        markdown = webpage_markdown(file.read_text().strip()) or ""
+
+    else:
+        # Fallback to MarkItDown for other formats
+        converter = MarkItDown()
+        log("INFO", f"Using MarkItDown fallback for {file.name}")
+        markdown = converter.convert(str(file)).text_content
+
+    return {"markdown": markdown, "extract": time.perf_counter() - start}
@@ -0,0 +1,136 @@
+# index_factory.py
+
+import faiss
+import numpy as np
+from typing import Optional
+
+INDEX_TYPES = ("flat", "sq8", "fp16", "pq", "ivf_flat", "ivf_sq8", "ivf_pq", "hnsw")
+METRICS = {"l2": faiss.METRIC_L2, "ip": faiss.METRIC_INNER_PRODUCT}
+SQ_TYPES = {"sq8": faiss.ScalarQuantizer.QT_8bit, "fp16": faiss.ScalarQuantizer.QT_fp16}
+SQ8_MIN_TRAIN = 1000  # enough rows to estimate per-dimension ranges
+
+DEFAULT_INDEX_CONFIG = {
+    "type": "flat",
+    "metric": "l2",          # l2, or ip (cosine, as all stored vectors are unit length)
+    "nlist": 256,            # IVF cells
+    "pq_m": 16,              # PQ sub-quantizers (must divide the embedding dim)
+    "pq_bits": 8,
+    "hnsw_m": 32,
+    "ef_construction": 200,
+    "nprobe": 16,            # IVF cells probed per query
+    "ef_search": 64,         # HNSW candidate list per query
+    "min_train_vectors": None,  # default per type: 39 points per k-means centroid (FAISS's minimum)
+}
+
+
+def index_config(config: Optional[dict]) -> dict:
+    merged = {**DEFAULT_INDEX_CONFIG, **(config or {})}
+    if merged["type"] not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{merged['type']}', expected one of {INDEX_TYPES}")
+    if merged["metric"] not in METRICS:
+        raise ValueError(f"Unknown metric '{merged['metric']}', expected one of {tuple(METRICS)}")
+    return merged
+
+
+def needs_training(config: dict) -> bool:
+    return config["type"] in ("sq8", "pq", "ivf_flat", "ivf_sq8", "ivf_pq")
+
+
+def min_train_vectors(config: dict) -> int:
+    if config["min_train_vectors"]:
+        return config["min_train_vectors"]
+    kind = config["type"]
+    needed = 0
+    if kind.startswith("ivf_"):
+        needed = 39 * config["nlist"]
+    if kind.endswith("pq"):
+        needed = max(needed, 39 * 2 ** config["pq_bits"])
+    if kind == "sq8":
+        needed = SQ8_MIN_TRAIN
+    return needed
+
+
+def target_index_type(n_vectors: int, config: dict) -> str:
+    """Type to build for `n_vectors`: the configured one, or flat while a trained type lacks training data."""
+    if needs_training(config) and n_vectors < min_train_vectors(config):
+        return "flat"
+    return config["type"]
+
+
+def index_type_of(index) -> str:
+    """Name of the configured type an index object was built as."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFScalarQuantizer):
+        return "ivf_sq8"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexPQ):
+        return "pq"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "flat"
+
+
+def index_metric_of(index) -> str:
+    return "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+
+def coarse_quantizer(dim: int, metric: int):
+    return faiss.IndexFlatIP(dim) if metric == faiss.METRIC_INNER_PRODUCT else faiss.IndexFlatL2(dim)
+
+
+def build_index(vectors: np.ndarray, config: dict, ids: Optional[np.ndarray] = None):
+    """
+    Build an index of the configured type over `vectors`, wrapped in IndexIDMap2 so
+    rows can be removed by id. `ids` default to 0..n-1.
+    Trained types (IVF, PQ, SQ8) fall back to flat until there are enough vectors to train on.
+    With metric "ip" the vectors must already be unit length, which makes scores cosines.
+    """
+    dim = vectors.shape[1]
+    kind = target_index_type(len(vectors), config)
+    metric = METRICS[config["metric"]]
+
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, config["hnsw_m"], metric)
+        index.hnsw.efConstruction = config["ef_construction"]
+    elif kind == "ivf_flat":
+        index = faiss.IndexIVFFlat(coarse_quantizer(dim, metric), dim, config["nlist"], metric)
+    elif kind == "ivf_sq8":
+        index = faiss.IndexIVFScalarQuantizer(coarse_quantizer(dim, metric), dim, config["nlist"],
+                                              SQ_TYPES["sq8"], metric)
+    elif kind == "ivf_pq":
+        index = faiss.IndexIVFPQ(coarse_quantizer(dim, metric), dim, config["nlist"], config["pq_m"],
+                                 config["pq_bits"], metric)
+    elif kind == "pq":
+        index = faiss.IndexPQ(dim, config["pq_m"], config["pq_bits"], metric)
+    elif kind in SQ_TYPES:
+        index = faiss.IndexScalarQuantizer(dim, SQ_TYPES[kind], metric)
+    else:
+        index = coarse_quantizer(dim, metric)
+
+    if not index.is_trained:
+        index.train(vectors)
+    index = faiss.IndexIDMap2(index)
+    if len(vectors):
+        index.add_with_ids(vectors, np.arange(len(vectors)) if ids is None else np.asarray(ids, dtype=np.int64))
+    return index
+
+
+def live_ids(index) -> np.ndarray:
+    """Ids currently in an IndexIDMap2, ascending."""
+    return np.sort(faiss.vector_to_array(index.id_map))
+
+
+def search_params(index, config: dict, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Per-query FAISS SearchParameters for the index type (None for flat)."""
+    kind = index_type_of(index)
+    if kind.startswith("ivf_"):
+        return faiss.SearchParametersIVF(nprobe=nprobe or config["nprobe"])
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=ef_search or config["ef_search"])
+    return None
@@ -0,0 +1,190 @@
+# lexical_index.py
+
+import os
+import re
+import sys
+import json
+import math
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+
+class LexicalIndex:
+    """
+    Persistent BM25 inverted index over document chunks, keyed by the same ids as
+    the FAISS index (chunk store rows). Updated in place with add/remove.
+
+    <name>.jsonl is an append-only log of {"add": id, "length": n, "tf": {term: tf}} and
+    {"remove": [ids]} records. save() appends only what changed since the last save, so
+    committing a document costs O(document) rather than O(corpus), and refresh() in
+    other processes replays only the records they have not read yet. Once the log holds
+    REWRITE_RATIO records per live document, save() rewrites it with just the live ones.
+    """
+
+    K1 = 1.5
+    B = 0.75
+    REWRITE_RATIO = 2
+    MIN_REWRITE_RECORDS = 1024
+
+    def __init__(self, directory: Path, name: str = "lexical"):
+        self.path = Path(directory) / f"{name}.jsonl"
+        self.docs: Dict[int, Tuple[int, Tuple[str, ...]]] = {}  # id -> (length, terms)
+        self.postings: Dict[str, Dict[int, int]] = {}           # term -> {id: term frequency}
+        self.total_length = 0
+        self._lock = threading.RLock()
+        self._pending: List[dict] = []  # log records not saved yet
+        self._inode = None              # log file the state below was read from
+        self._offset = 0                # bytes of it already applied
+        self._records = 0               # records in it
+        self.refresh()
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return re.findall(r"\w+", text.lower())
+
+    def refresh(self):
+        """Apply records other processes appended since the last look (all of them if the log was rewritten)."""
+        with self._lock:
+            try:
+                st = self.path.stat()
+            except FileNotFoundError:
+                return
+            if st.st_ino != self._inode or st.st_size < self._offset:
+                self.docs, self.postings, self.total_length = {}, {}, 0
+                self._inode, self._offset, self._records = st.st_ino, 0, 0
+            if st.st_size == self._offset:
+                return
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                tail = f.read(st.st_size - self._offset)
+            end = tail.rfind(b"\n") + 1  # a torn last record is picked up once it is complete
+            for line in tail[:end].splitlines():
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError):
+                    continue
+                self._records += 1
+            self._offset += end
+
+    def save(self):
+        with self._lock:
+            if not self._pending:
+                return
+            try:
+                st = self.path.stat()
+            except FileNotFoundError:
+                st = None
+            records = self._records + len(self._pending)
+            if st is None or st.st_ino != self._inode or records > max(self.REWRITE_RATIO * len(self.docs), self.MIN_REWRITE_RECORDS):
+                self._rewrite()
+            else:
+                with open(self.path, "ab") as f:
+                    if f.tell() > self._offset:
+                        f.truncate(self._offset)  # torn record of a save that crashed
+                    f.write(b"".join(self._encode(record) for record in self._pending))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._offset = f.tell()
+                self._records = records
+            self._pending.clear()
+
+    def _rewrite(self):
+        """Replace the log with one add record per live document."""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            for doc_id, (length, terms) in self.docs.items():
+                f.write(self._encode({"add": doc_id, "length": length,
+                                      "tf": {term: self.postings[term][doc_id] for term in terms}}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        st = self.path.stat()
+        self._inode, self._offset, self._records = st.st_ino, st.st_size, len(self.docs)
+
+    @staticmethod
+    def _encode(record: dict) -> bytes:
+        return json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+
+    def _apply(self, record: dict):
+        if "remove" in record:
+            self._remove(record["remove"])
+        else:
+            self._insert(int(record["add"]), record["length"], record["tf"])
+
+    def _insert(self, doc_id: int, length: int, counts: Dict[str, int]):
+        self._remove([doc_id])
+        terms = tuple(sys.intern(term) for term in counts)  # shared with the postings keys
+        for term in terms:
+            self.postings.setdefault(term, {})[doc_id] = counts[term]
+        self.docs[doc_id] = (length, terms)
+        self.total_length += length
+
+    def _remove(self, ids: Iterable[int]) -> List[int]:
+        removed = []
+        for doc_id in map(int, ids):
+            doc = self.docs.pop(doc_id, None)
+            if doc is None:
+                continue
+            length, terms = doc
+            self.total_length -= length
+            for term in terms:
+                postings = self.postings.get(term, {})
+                postings.pop(doc_id, None)
+                if not postings:
+                    self.postings.pop(term, None)
+            removed.append(doc_id)
+        return removed
+
+    def ids(self) -> np.ndarray:
+        with self._lock:
+            return np.fromiter(self.docs, dtype=np.int64, count=len(self.docs))
+
+    def add(self, ids: Iterable[int], texts: Iterable[str]):
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                tokens = self.tokenize(text)
+                counts: Dict[str, int] = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                self._insert(int(doc_id), len(tokens), counts)
+                self._pending.append({"add": int(doc_id), "length": len(tokens), "tf": counts})
+
+    def remove(self, ids: Iterable[int]):
+        with self._lock:
+            removed = self._remove(ids)
+            if removed:
+                self._pending.append({"remove": removed})
+
+    def stats(self, terms: List[str]) -> Tuple[int, int, np.ndarray]:
+        """Number of documents, their total length, and how many of them contain each term."""
+        with self._lock:
+            return len(self.docs), self.total_length, np.array([len(self.postings.get(term, ())) for term in terms], dtype=np.float32)
+
+    @staticmethod
+    def bm25_idf(n_docs: int, df: np.ndarray) -> np.ndarray:
+        """BM25 idf for document frequencies df (terms absent from the corpus get the maximum)."""
+        return np.log(1 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    def search(self, query: str, k: int, idf: Dict[str, float] = None, avg_length: float = None) -> List[Tuple[int, float]]:
+        """
+        Top-k (id, BM25 score), best first. idf (term -> weight) and avg_length default to this
+        index's own statistics; pass corpus-wide ones so several indexes score on one scale.
+        """
+        with self._lock:
+            n_docs = len(self.docs)
+            if not n_docs:
+                return []
+            avg_length = max(self.total_length / n_docs if avg_length is None else avg_length, 1e-9)
+            scores: Dict[int, float] = {}
+            for term in set(self.tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                weight = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5)) if idf is None else idf[term]
+                for doc_id, tf in postings.items():
+                    norm = self.K1 * (1 - self.B + self.B * self.docs[doc_id][0] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + weight * tf * (self.K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
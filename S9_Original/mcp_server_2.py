@@ -3,7 +3,9 @@ from mcp.server.fastmcp.prompts import base
 from mcp.types import TextContent
 from mcp import types
 from PIL import Image as PILImage
+import io
 import math
+import asyncio
 import sys
 import os
 import json
@@ -11,23 +13,38 @@ import faiss
 import numpy as np
 from pathlib import Path
 import requests
-from markitdown import MarkItDown
 import time
-from models import AddInput, AddOutput, SqrtInput, SqrtOutput, StringsToIntsInput, StringsToIntsOutput, ExpSumInput, ExpSumOutput, PythonCodeInput, PythonCodeOutput, UrlInput, FilePathInput, MarkdownInput, MarkdownOutput, ChunkListOutput, SearchDocumentsInput
+import yaml
+from chunk_store import ChunkStore, VectorStore
+from modules.llm_cache import ResponseCache
+from lexical_index import LexicalIndex
+from reranker import rerank_scores
+from chunker import chunk_mode_for, markdown_chunks, markdown_units, semantic_pack
+from extractor import CAPTIONED_TYPES, extract_markdown, pdf_markdown, webpage_markdown
+from index_factory import index_config, build_index, index_type_of, index_metric_of, live_ids, target_index_type, search_params
+from models import AddInput, AddOutput, SqrtInput, SqrtOutput, StringsToIntsInput, StringsToIntsOutput, ExpSumInput, ExpSumOutput, PythonCodeInput, PythonCodeOutput, UrlInput, FilePathInput, MarkdownInput, MarkdownOutput, ChunkListOutput, SearchDocumentsInput, SearchDocumentsBatchInput, RebuildShardInput, EmptyInput, IngestionStatusOutput
 from tqdm import tqdm
 import hashlib
 from pydantic import BaseModel
 import subprocess
 import sqlite3
-import trafilatura
-import pymupdf4llm
 import re
 import base64 # ollama needs base64-encoded-image
+import threading
+import multiprocessing
+import heapq
+import itertools
+import shutil
+import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 
 
 mcp = FastMCP("Calculator")
 
 EMBED_URL = "http://localhost:11434/api/embeddings"
+EMBED_BATCH_URL = "http://localhost:11434/api/embed"  # takes a list of inputs per request
 OLLAMA_CHAT_URL = "http://localhost:11434/api/chat"
 OLLAMA_URL = "http://localhost:11434/api/generate"
 EMBED_MODEL = "nomic-embed-text"
@@ -38,13 +55,564 @@ CHUNK_SIZE = 256
 CHUNK_OVERLAP = 40
 MAX_CHUNK_LENGTH = 512  # characters
 TOP_K = 3  # FAISS top-K matches
+EMBED_BATCH_SIZE = 32  # chunks per embedding request
+EMBED_CONCURRENCY = 4  # embedding requests in flight
+EMBED_RETRIES = 3
+EMBED_BACKOFF = 0.5  # seconds, doubled after each failed attempt
+CAPTION_CONCURRENCY = 4  # caption requests in flight, across all documents
+CAPTION_TIMEOUT = 120  # seconds to connect, and between streamed parts of a caption
+MIN_CAPTION_SIDE = 32  # px; smaller images are icons, bullets and rules, not worth a model call
+CAPTION_TTL = 90 * 24 * 3600  # captions depend only on the image bytes, so keep them for a long time
+CAPTION_PROMPT = "If there is lot of text in the image, then ONLY reply back with exact text in the image, else Describe the image such that your result can replace 'alt-text' for it. Only explain the contents of the image and provide no further explaination."
 ROOT = Path(__file__).parent.resolve()
+INDEX_DIR = ROOT / "faiss_index"  # shard 0; shard n > 0 lives in faiss_index/shard_NN/
+PROFILE_YAML = ROOT / "config" / "profiles.yaml"
+RAG_CONFIG = (yaml.safe_load(PROFILE_YAML.read_text()) or {}).get("rag", {})
+INDEX_CONFIG = index_config(RAG_CONFIG.get("index"))
+SHARD_COUNT = max(int(RAG_CONFIG.get("shards") or 1), 1)
+INGEST_WORKERS = RAG_CONFIG.get("ingest", {}).get("workers") or os.cpu_count() or 1
+EMBED_FILES_IN_FLIGHT = RAG_CONFIG.get("ingest", {}).get("embed_files_in_flight", 2)
+WATCH_INTERVAL = RAG_CONFIG.get("ingest", {}).get("watch_interval")
+SEARCH_CONFIG = RAG_CONFIG.get("search", {})
+HYBRID_SEARCH = SEARCH_CONFIG.get("hybrid", True)
+SEARCH_TOP_K = SEARCH_CONFIG.get("top_k", 5)
+SEARCH_CANDIDATES = SEARCH_CONFIG.get("candidates", 20)  # per retriever, before fusion
+RRF_K = SEARCH_CONFIG.get("rrf_k", 60)
+QUERY_CACHE_SIZE = SEARCH_CONFIG.get("query_cache_size", 512)
+RERANK_CONFIG = SEARCH_CONFIG.get("rerank", {})
+RERANK_ENABLED = RERANK_CONFIG.get("enabled", False)
+RERANK_CANDIDATES = RERANK_CONFIG.get("candidates", 50)
+RERANK_TOP_K = RERANK_CONFIG.get("top_k", SEARCH_TOP_K)
+RERANK_MIN_SCORE = RERANK_CONFIG.get("min_score")
+HASH_BLOCK_SIZE = 1 << 20
+CHUNK_CONFIG = RAG_CONFIG.get("chunking", {})
+CHUNK_PARAMS = {key: CHUNK_CONFIG[key] for key in ("max_words", "min_words", "heading_level") if key in CHUNK_CONFIG}
+
+# One keep-alive session for all embedding traffic
+http = requests.Session()
+http.mount("http://", HTTPAdapter(pool_connections=EMBED_CONCURRENCY, pool_maxsize=EMBED_CONCURRENCY))
+_batch_embed_supported = None  # unknown until the first batch request
+_embed_slots = threading.BoundedSemaphore(EMBED_CONCURRENCY)  # shared by every file being embedded
+_caption_slots = threading.BoundedSemaphore(CAPTION_CONCURRENCY)  # shared by every document being captioned
+_caption_cache = None  # opened on first use
+_lazy_lock = threading.Lock()
+
+
+def get_caption_cache() -> ResponseCache:
+    global _caption_cache
+    with _lazy_lock:
+        if _caption_cache is None:
+            _caption_cache = ResponseCache(max_entries=512, ttl=CAPTION_TTL,
+                                           sqlite_path=str(ROOT / "cache" / "captions.sqlite"), max_persistent_entries=20000)
+        return _caption_cache
+
+
+def post_with_retry(url: str, payload: dict) -> dict:
+    for attempt in range(EMBED_RETRIES + 1):
+        try:
+            with _embed_slots:
+                result = http.post(url, json=payload, timeout=120)
+            result.raise_for_status()
+            return result.json()
+        except requests.RequestException as e:
+            status = getattr(e.response, "status_code", None)
+            if (status is not None and status < 500 and status != 429) or attempt == EMBED_RETRIES:
+                raise
+            delay = EMBED_BACKOFF * 2 ** attempt
+            mcp_log("WARN", f"Embedding request failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    # /api/embed returns unit vectors and /api/embeddings doesn't; normalize so both agree
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _embed_batch(texts: list[str]) -> np.ndarray:
+    global _batch_embed_supported
+    if _batch_embed_supported is not False:
+        try:
+            data = post_with_retry(EMBED_BATCH_URL, {"model": EMBED_MODEL, "input": texts})
+            _batch_embed_supported = True
+            return np.array(data["embeddings"], dtype=np.float32)
+        except requests.HTTPError as e:
+            if getattr(e.response, "status_code", None) != 404:
+                raise
+            if _batch_embed_supported is not False:
+                mcp_log("WARN", "Batch embedding endpoint not available — falling back to single requests")
+            _batch_embed_supported = False
+    return np.stack([
+        np.array(post_with_retry(EMBED_URL, {"model": EMBED_MODEL, "prompt": text})["embedding"], dtype=np.float32)
+        for text in texts
+    ])
+
+
+def get_embeddings(texts: list[str], batch_size: int = EMBED_BATCH_SIZE,
+                   concurrency: int = EMBED_CONCURRENCY, desc: str = None) -> np.ndarray:
+    """Embed many texts: `batch_size` per request, at most `concurrency` requests at once. Rows keep input order."""
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    results = [None] * len(batches)
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(batches))) as pool, \
+            tqdm(total=len(texts), desc=desc, disable=desc is None) as progress:
+        futures = {pool.submit(_embed_batch, batch): i for i, batch in enumerate(batches)}
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            progress.update(len(batches[i]))
+    return normalize(np.vstack(results))
 
 
 def get_embedding(text: str) -> np.ndarray:
-    result = requests.post(EMBED_URL, json={"model": EMBED_MODEL, "prompt": text})
-    result.raise_for_status()
-    return np.array(result.json()["embedding"], dtype=np.float32)
+    return get_embeddings([text])[0]
+
+
+def load_index(index_file: Path):
+    """
+    Read a FAISS index for writing, normalizing vectors written before embeddings were
+    unit-length. Only the ingestion worker and offline commands call this; searches use
+    faiss.read_index directly and never migrate.
+    """
+    index = faiss.read_index(str(index_file))
+    meta_file = index_file.parent / "index_meta.json"
+    meta = json.loads(meta_file.read_text()) if meta_file.exists() else {}
+    if not meta.get("normalized") and index.ntotal:
+        mcp_log("INFO", f"Normalizing {index.ntotal} stored vectors to unit length (one-time migration)")
+        vectors = normalize(index.reconstruct_n(0, index.ntotal))
+        index = faiss.IndexFlatL2(index.d)
+        index.add(vectors)
+        write_atomic(index_file, lambda p: faiss.write_index(index, str(p)))
+    if not meta.get("normalized"):
+        write_atomic(meta_file, lambda p: p.write_text(json.dumps({**meta, "normalized": True}, indent=2)))
+    return index
+
+
+def write_atomic(path: Path, write) -> None:
+    """Write via `write(tmp_path)` then rename over `path`, so readers never see a partial file."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+class ResidentIndex:
+    """
+    Keeps the FAISS index and chunk store open between searches.
+    get() reloads the index only when index.bin changes on disk (mtime/size); publish()
+    writes a new version and swaps it in under the lock. The chunk store is append-only
+    and rows are added before the index that points at them, so every row id a
+    search can return already has its chunk. Searches never write: migrations are
+    left to the ingestion worker.
+    """
+
+    def __init__(self, index_file: Path, store: ChunkStore):
+        self.index_file = index_file
+        self.store = store
+        self.generation = 0
+        self._lock = threading.RLock()
+        self._index = None
+        self._live = None  # sorted ids of _index, computed on first use
+        self._stamp = None
+
+    def _disk_stamp(self):
+        try:
+            st = self.index_file.stat()
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+
+    def get(self):
+        """Return the current (index, chunk store) pair; index is None if nothing is indexed yet."""
+        with self._lock:
+            stamp = self._disk_stamp()
+            if stamp is not None and stamp != self._stamp:
+                try:
+                    index = faiss.read_index(str(self.index_file))  # read-only; migrations are the worker's
+                    self._index, self._live = index, None
+                    self._stamp = self._disk_stamp()
+                    self.generation += 1
+                    mcp_log("INFO", f"Loaded FAISS index generation {self.generation} ({index.ntotal} vectors)")
+                except Exception as e:
+                    # e.g. another process is mid-write; keep serving the previous version
+                    mcp_log("WARN", f"Could not reload index, keeping generation {self.generation}: {e}")
+            return self._index, self.store
+
+    def publish(self, index):
+        """Persist a new index version and make it the one searches use."""
+        index = faiss.clone_index(index)  # the caller keeps mutating its own copy
+        with self._lock:
+            write_atomic(self.index_file, lambda p: faiss.write_index(index, str(p)))
+            self._index, self._live = index, None
+            self._stamp = self._disk_stamp()
+            self.generation += 1
+
+    def ids(self, index) -> np.ndarray:
+        """Sorted ids of `index`, cached while it is the resident version."""
+        with self._lock:
+            if index is not self._index:
+                return live_ids(index)
+            if self._live is None:
+                self._live = live_ids(index)
+            return self._live
+
+
+class Shard:
+    """
+    One partition of the corpus: the documents whose names hash to it (shard_of), with
+    their own chunk store, vector store, BM25 index, FAISS index and manifest. Shard 0 is
+    faiss_index/ itself, so an unsharded index needs no migration. `lock` admits one
+    writer (ingestion or a rebuild) per shard at a time; searches never take it and read
+    the ResidentIndex snapshot instead. `index` and `manifest` are the writer's working
+    copies, set by load_shard.
+    """
+
+    def __init__(self, number: int):
+        self.number = number
+        self.directory = INDEX_DIR if number == 0 else INDEX_DIR / f"shard_{number:02d}"
+        self.manifest_file = self.directory / "doc_index_cache.json"
+        self.compact_marker = self.directory / "compact.pending"
+        self.chunks = ChunkStore(self.directory)
+        self.vectors = VectorStore(self.directory)
+        self.lexical = LexicalIndex(self.directory)
+        self.resident = ResidentIndex(self.directory / "index.bin", self.chunks)
+        self.lock = threading.RLock()
+        self.index = None
+        self.manifest = {}
+
+    @property
+    def index_file(self) -> Path:
+        return self.resident.index_file
+
+    def __repr__(self):
+        return f"shard {self.number}"
+
+
+def shard_of(name: str) -> int:
+    """Shard number of a document; md5 rather than hash() so every process agrees."""
+    return int(hashlib.md5(name.encode("utf-8")).hexdigest()[:8], 16) % SHARD_COUNT
+
+
+_shards = None  # created on first use
+
+
+def get_shards() -> list:
+    """
+    The shards, opened on first use. Spawned extraction workers import this module as
+    __mp_main__, so nothing at import time may load an index or open a database.
+    """
+    global _shards
+    with _lazy_lock:
+        if _shards is None:
+            _shards = [Shard(number) for number in range(SHARD_COUNT)]
+        return _shards
+
+
+search_pool = ThreadPoolExecutor(max_workers=max(4, 2 * SHARD_COUNT))  # every shard's vector and BM25 retrievers side by side
+query_pool = ThreadPoolExecutor(max_workers=4)  # whole search requests, off the MCP event loop
+_query_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()  # normalized query text -> embedding (LRU)
+_query_lock = threading.Lock()
+
+
+def migrate_metadata_json(store: ChunkStore):
+    """One-time import of the old pretty-printed metadata.json into the chunk store."""
+    legacy_file = store.idx_path.parent / "metadata.json"
+    if not legacy_file.exists():
+        return
+    records = json.loads(legacy_file.read_text())
+    if len(store) != len(records):  # empty, or a previous migration was interrupted
+        store.truncate(0)
+        store.append(records)
+        mcp_log("INFO", f"Migrated {len(records)} chunks from metadata.json to the chunk store")
+    legacy_file.unlink()
+
+
+def upgrade_index(shard: Shard, index):
+    """
+    Wrap an index written before per-document ids in IndexIDMap2 (id = chunk store row),
+    backfilling vectors.f32 from it first.
+    """
+    if isinstance(index, faiss.IndexIDMap2):
+        return index
+    shard.vectors.truncate(index.ntotal)
+    if len(shard.vectors) < index.ntotal:
+        missing = index.reconstruct_n(len(shard.vectors), index.ntotal - len(shard.vectors))
+        shard.vectors.append(missing)
+        mcp_log("INFO", f"Backfilled {len(missing)} vectors into the vector store")
+    mcp_log("INFO", f"Adding chunk ids to the {index.ntotal}-vector index (one-time migration)")
+    return build_index(shard.vectors.matrix(0, index.ntotal), INDEX_CONFIG)
+
+
+def maybe_rebuild(shard: Shard, index, force: bool = False):
+    """
+    Rebuild the index from the stored vectors when it is not the type profiles.yaml asks for,
+    e.g. the config changed, or an IVF index now has enough vectors to train.
+    `force` rebuilds regardless, retraining IVF/PQ on the shard's current vectors.
+    """
+    target = target_index_type(index.ntotal, INDEX_CONFIG)
+    if not force and index_type_of(index) == target and index_metric_of(index) == INDEX_CONFIG["metric"]:
+        return index
+    start = time.perf_counter()
+    ids = live_ids(index)
+    index = build_index(shard.vectors.take(ids), INDEX_CONFIG, ids=ids)
+    mcp_log("INFO", f"Rebuilt {shard} as {target} ({INDEX_CONFIG['metric']}) over {index.ntotal} vectors "
+                    f"in {time.perf_counter() - start:.2f}s")
+    return index
+
+
+def log_index_footprint():
+    """Index size on disk, which is also what it occupies in RAM once loaded, next to the raw vectors."""
+    for shard in get_shards():
+        if shard.index is None or not shard.index_file.exists():
+            continue
+        index = shard.index
+        index_bytes = shard.index_file.stat().st_size
+        raw_bytes = shard.vectors.path.stat().st_size if shard.vectors.path.exists() else 0
+        mcp_log("INFO", f"Index {shard.number}: {index_type_of(index)}/{index_metric_of(index)}, {index.ntotal} vectors, "
+                        f"index.bin {index_bytes / 2**20:.2f} MiB (~RAM; {index_bytes / max(index.ntotal, 1):.0f} B/vector), "
+                        f"vectors.f32 {raw_bytes / 2**20:.2f} MiB (disk only, for rebuilds)")
+
+
+def drop_ids(shard: Shard, index, ids):
+    """Remove ids from the index. HNSW can't delete, so it is rebuilt without them."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(ids):
+        return index
+    try:
+        index.remove_ids(ids)
+        return index
+    except RuntimeError:
+        keep = np.setdiff1d(live_ids(index), ids)
+        return build_index(shard.vectors.take(keep), INDEX_CONFIG, ids=keep)
+
+
+def range_ids(ranges) -> np.ndarray:
+    return np.concatenate([np.arange(start, stop, dtype=np.int64) for start, stop in ranges] or [np.empty(0, dtype=np.int64)])
+
+
+def load_doc_manifest(shard: Shard, index) -> dict:
+    """
+    doc_index_cache.json: file name -> {"hash": md5, "ranges": [[first_id, stop_id], ...]}.
+    Older caches map names to bare hashes; their ranges are recovered from the chunk store,
+    keeping only each file's most recent run (chunk ids restart at _0), so copies left
+    behind by earlier edits become orphans.
+    """
+    manifest = json.loads(shard.manifest_file.read_text()) if shard.manifest_file.exists() else {}
+    if all(isinstance(entry, dict) for entry in manifest.values()):
+        return manifest
+    ids = live_ids(index) if index is not None else []
+    runs, last_row = {}, {}
+    for row, record in zip(map(int, ids), shard.chunks.get_many(ids)):
+        doc = record["doc"]
+        if last_row.get(doc) != row - 1 or record["chunk_id"] == f"{Path(doc).stem}_0":
+            runs[doc] = [row, row + 1]
+        else:
+            runs[doc][1] = row + 1
+        last_row[doc] = row
+    return {name: {"hash": fhash, "ranges": [runs[name]] if name in runs else []} for name, fhash in manifest.items()}
+
+
+def reconcile(shard: Shard, index, manifest: dict):
+    """
+    Make the index and manifest agree after a crash or a legacy upgrade: ids no entry owns
+    are removed, and entries whose ids are not all in the index are cleared for re-indexing.
+    """
+    live = live_ids(index)
+    owned = range_ids([r for entry in manifest.values() for r in entry["ranges"]])
+    orphans = np.setdiff1d(live, owned)
+    if len(orphans):
+        mcp_log("INFO", f"Removing {len(orphans)} stale vectors from {shard}")
+        index = drop_ids(shard, index, orphans)
+    for name, entry in manifest.items():
+        ids = range_ids(entry["ranges"])
+        if not np.isin(ids, live).all():
+            mcp_log("WARN", f"Index is missing chunks of {name}; it will be re-indexed")
+            index = drop_ids(shard, index, ids[np.isin(ids, live)])
+            manifest[name] = {"hash": None, "ranges": []}
+    return index
+
+
+def sync_lexical_index(shard: Shard, index):
+    """Bring the BM25 index to exactly the ids in `index`, indexing only chunks it hasn't seen."""
+    live = live_ids(index) if index is not None else np.empty(0, dtype=np.int64)
+    known = shard.lexical.ids()
+    stale = np.setdiff1d(known, live)
+    missing = np.setdiff1d(live, known)
+    if not len(stale) and not len(missing):
+        return
+    shard.lexical.remove(stale)
+    shard.lexical.add(missing, (record["chunk"] for record in shard.chunks.get_many(missing)))
+    shard.lexical.save()
+
+
+def save_shard(shard: Shard):
+    """Publish the shard's working index to searches, with its BM25 index and manifest. Caller holds shard.lock."""
+    if shard.index is not None:
+        shard.resident.publish(shard.index)
+        sync_lexical_index(shard, shard.index)
+    write_atomic(shard.manifest_file, lambda p: p.write_text(json.dumps(shard.manifest, indent=2)))
+
+
+def load_shard(shard: Shard, doc_path: Path) -> list:
+    """
+    Load a shard's index and manifest for writing, recovering from legacy layouts, crashes
+    and config changes, and drop the files that were deleted or now hash to another shard.
+    Returns the latter as (name, entry, records, vectors) so they can move without being
+    extracted or embedded again. Caller holds shard.lock.
+    """
+    shard.directory.mkdir(parents=True, exist_ok=True)
+    finish_compaction(shard)
+    migrate_metadata_json(shard.chunks)
+    (shard.directory / "lexical.json").unlink(missing_ok=True)  # superseded by lexical.jsonl, rebuilt below
+    index = load_index(shard.index_file) if shard.index_file.exists() else None
+    leaving = []
+    if index is None:
+        shard.index, shard.manifest = None, {}  # nothing is indexed, whatever the cache says
+        shard.chunks.truncate(0)
+        shard.vectors.truncate(0)
+    else:
+        loaded = (index, index.ntotal, json.loads(shard.manifest_file.read_text()) if shard.manifest_file.exists() else {})
+        index = upgrade_index(shard, index)
+        shard.manifest = load_doc_manifest(shard, index)
+        index = reconcile(shard, index, shard.manifest)
+        # Rows past the highest live id belong to no index version (a run that died before publishing)
+        ids = live_ids(index)
+        committed = int(ids[-1]) + 1 if len(ids) else 0
+        shard.chunks.truncate(committed)
+        shard.vectors.truncate(committed)
+        index = maybe_rebuild(shard, index)
+
+        # Files removed from documents/ take their chunks with them; files that hash elsewhere
+        # since the shard count changed move to their new shard
+        for name in [name for name in shard.manifest if shard_of(name) != shard.number or not (doc_path / name).exists()]:
+            entry = shard.manifest.pop(name)
+            ids = range_ids(entry["ranges"])
+            if (doc_path / name).exists() and entry["hash"] is not None:
+                leaving.append((name, entry, shard.chunks.get_many(ids), shard.vectors.take(ids)))
+                mcp_log("INFO", f"Moving {name} from {shard} to shard {shard_of(name)}")
+            else:
+                mcp_log("DEL", f"Removed deleted file from the index: {name}")
+            index = drop_ids(shard, index, ids)
+        shard.index = index
+        if (index, index.ntotal, shard.manifest) != loaded:
+            save_shard(shard)
+    sync_lexical_index(shard, shard.index)  # built from the chunk store the first time
+    return leaving
+
+
+def commit_document(shard: Shard, name: str, entry: dict, records: list, embeddings: np.ndarray):
+    """
+    Replace a document's chunks in the shard and publish; no records just forgets its old
+    ones. Rows go to the stores first, so the published index never points past them.
+    Caller holds shard.lock.
+    """
+    index = shard.index
+    ranges = []
+    if records:
+        if index is None:
+            index = build_index(embeddings[:0], INDEX_CONFIG)
+            write_atomic(shard.directory / "index_meta.json", lambda p: p.write_text(json.dumps({"normalized": True}, indent=2)))
+        rows = shard.chunks.append(records)
+        shard.vectors.append(embeddings)
+        ranges = [[rows.start, rows.stop]]
+    old = shard.manifest.get(name)
+    if index is not None and old is not None:
+        index = drop_ids(shard, index, range_ids(old["ranges"]))  # replace the file's previous version
+    if ranges:
+        index.add_with_ids(embeddings, np.arange(rows.start, rows.stop, dtype=np.int64))
+        index = maybe_rebuild(shard, index)
+    shard.manifest[name] = {**entry, "ranges": ranges}
+    shard.index = index
+    save_shard(shard)
+
+
+def rebuild_shard(shard: Shard) -> str:
+    """
+    Rebuild one shard's index from its stored vectors (retraining IVF/PQ on what it holds
+    now) and publish it. Searches keep reading the shard's previous snapshot until the
+    swap and the other shards are untouched, so search stays online throughout; only
+    ingestion into this shard waits.
+    """
+    with shard.lock:
+        index = shard.index
+        if index is None:
+            if not shard.index_file.exists():
+                return f"{shard}: nothing indexed"
+            finish_compaction(shard)
+            index = upgrade_index(shard, load_index(shard.index_file))
+        shard.index = maybe_rebuild(shard, index, force=True)
+        shard.resident.publish(shard.index)  # same ids, so the BM25 index and manifest still hold
+        return f"{shard}: rebuilt as {index_type_of(shard.index)} over {shard.index.ntotal} vectors"
+
+
+def finish_compaction(shard: Shard):
+    """Complete the file swap of a compaction that was interrupted after writing its new files."""
+    if not shard.compact_marker.exists():
+        return
+    for src, dst in json.loads(shard.compact_marker.read_text()):
+        if (shard.directory / src).exists():
+            os.replace(shard.directory / src, shard.directory / dst)
+    shard.compact_marker.unlink()
+
+
+def compact_index():
+    """
+    Offline compaction: rewrite each shard's chunk and vector stores with only the live rows,
+    renumber ids 0..n-1 and rebuild the index. Run it while no document server is
+    using faiss_index/ (python mcp_server_2.py compact).
+    """
+    for shard in get_shards():
+        compact_shard(shard)
+
+
+def compact_shard(shard: Shard):
+    finish_compaction(shard)
+    migrate_metadata_json(shard.chunks)
+    if not shard.index_file.exists():
+        mcp_log("INFO", f"No index to compact in {shard}")
+        return
+    index = upgrade_index(shard, load_index(shard.index_file))
+    manifest = load_doc_manifest(shard, index)
+    index = reconcile(shard, index, manifest)
+    ids = live_ids(index)
+    before = len(shard.chunks)
+
+    directory = shard.directory
+    renames = [("chunks.compact.bin", "chunks.bin"), ("chunks.compact.idx", "chunks.idx"),
+               ("vectors.compact.f32", "vectors.f32"), ("vectors.compact.json", "vectors.json"),
+               ("index.compact.bin", "index.bin"), ("doc_index_cache.compact.json", "doc_index_cache.json"),
+               ("lexical.compact.jsonl", "lexical.jsonl")]
+    for src, _ in renames:
+        (directory / src).unlink(missing_ok=True)  # leftovers of a compaction that died before its swap
+
+    new_chunks = ChunkStore(directory, name="chunks.compact")
+    new_vectors = VectorStore(directory, name="vectors.compact", dim=index.d)
+    new_vectors.meta_path.write_text(json.dumps({"dim": index.d}))
+    for start in range(0, len(ids), 4096):
+        batch = ids[start:start + 4096]
+        new_chunks.append(shard.chunks.get_many(batch))
+        new_vectors.append(shard.vectors.take(batch))
+
+    # Every live entry's range is contiguous and fully live, so it stays contiguous after renumbering
+    new_id = {int(old): new for new, old in enumerate(ids)}
+    compacted_manifest = {
+        name: {**entry,
+               "ranges": [[new_id[start], new_id[stop - 1] + 1] for start, stop in entry["ranges"] if stop > start]}
+        for name, entry in manifest.items() if entry["hash"] is not None
+    }
+    compacted = build_index(new_vectors.matrix(), INDEX_CONFIG)
+    new_lexical = LexicalIndex(directory, name="lexical.compact")
+    new_lexical.add(range(len(ids)), (record["chunk"] for record in new_chunks.get_many(range(len(ids)))))
+    new_lexical.save()
+    faiss.write_index(compacted, str(directory / "index.compact.bin"))
+    (directory / "doc_index_cache.compact.json").write_text(json.dumps(compacted_manifest, indent=2))
+
+    new_chunks.close()
+    shard.chunks.close()
+    shard.compact_marker.write_text(json.dumps(renames))
+    finish_compaction(shard)
+    mcp_log("INFO", f"Compacted {shard} from {before} stored chunks to {len(ids)} live chunks ({index_type_of(compacted)} index)")
+
 
 def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
     words = text.split()
@@ -96,92 +664,375 @@ Just respond in one word (Yes or No), and do not provide any further explanation
 
 
 
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def embed_queries(queries: list[str]) -> np.ndarray:
+    """Query embeddings from the LRU cache; all misses go to Ollama in a single batch."""
+    keys = [normalize_query(query) for query in queries]
+    with _query_lock:
+        cached = {key: _query_vectors[key] for key in keys if key in _query_vectors}
+        for key in cached:
+            _query_vectors.move_to_end(key)
+    missing = list(dict.fromkeys(key for key in keys if key not in cached))
+    if missing:
+        fresh = dict(zip(missing, get_embeddings(missing)))
+        with _query_lock:
+            for key, vector in fresh.items():
+                _query_vectors[key] = vector
+                _query_vectors.move_to_end(key)
+            while len(_query_vectors) > QUERY_CACHE_SIZE:
+                _query_vectors.popitem(last=False)
+        cached.update(fresh)
+    return np.stack([cached[key] for key in keys]).astype(np.float32)
+
+
+def vector_search(shard: Shard, index, query_vecs: np.ndarray, k: int, params=None) -> list[list[tuple]]:
+    """
+    One index.search over the stacked query matrix; per query, ((shard, id), score) best first,
+    where score is the inner product or the negated L2 distance so that higher is closer.
+    """
+    D, I = index.search(query_vecs, k=k, params=params)
+    sign = 1.0 if index_metric_of(index) == "ip" else -1.0
+    return [[((shard.number, int(idx)), sign * float(dist)) for idx, dist in zip(ids, dists) if idx >= 0]
+            for ids, dists in zip(I, D)]
+
+
+def lexical_search(shard: Shard, index, query: str, k: int, idf: dict, avg_length: float) -> list[tuple]:
+    """
+    BM25 hits limited to the ids of the index snapshot being searched (BM25 catches up just
+    after each publish), scored with the corpus-wide idf and avg_length of corpus_bm25.
+    """
+    hits = shard.lexical.search(query, k, idf=idf, avg_length=avg_length)
+    live = shard.resident.ids(index)
+    if not hits or not len(live):
+        return []
+    ids = np.array([doc_id for doc_id, _ in hits], dtype=np.int64)
+    present = live[np.minimum(np.searchsorted(live, ids), len(live) - 1)] == ids
+    return [((shard.number, doc_id), score) for (doc_id, score), keep in zip(hits, present) if keep]
+
+
+def merge_hits(hits: list[list[tuple]], k: int) -> list[tuple]:
+    """The k best (shard, id) keys across the shards' (key, score) lists."""
+    return [key for key, _ in heapq.nlargest(k, itertools.chain.from_iterable(hits), key=lambda hit: hit[1])]
+
+
+def rrf_scores(rankings: list[list], k: int = RRF_K) -> dict:
+    """Reciprocal-rank fusion: each list adds 1 / (k + rank) to an id's score."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+def rrf_fuse(rankings: list[list], k: int = RRF_K) -> list:
+    scores = rrf_scores(rankings, k)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def retrieve(snapshot: list[tuple], queries: list[str], k: int = SEARCH_TOP_K, nprobe: int = None,
+             ef_search: int = None, timings: dict = None) -> list[dict]:
+    """
+    Per query: fused (shard, id) -> score for its k best chunks (vector-only scores if hybrid is off).
+    Every (shard, index) in the snapshot is searched at once on search_pool, and each retriever's
+    hits are merged across shards by score before fusion (BM25 scores use corpus-wide statistics,
+    so they compare across shards).
+    """
+    timings = {} if timings is None else timings
+    candidates = max(SEARCH_CANDIDATES, k) if HYBRID_SEARCH else k
+    start = time.perf_counter()
+    lexical_hits = []
+    if HYBRID_SEARCH:
+        for shard, _ in snapshot:
+            shard.lexical.refresh()
+        lexical_hits = [[search_pool.submit(lexical_search, shard, index, query, candidates, *corpus_bm25(query))
+                         for shard, index in snapshot] for query in queries]
+    query_vecs = embed_queries(queries)
+    embedded = time.perf_counter()
+    vector_hits = [search_pool.submit(vector_search, shard, index, query_vecs, candidates,
+                                      search_params(index, INDEX_CONFIG, nprobe=nprobe, ef_search=ef_search))
+                   for shard, index in snapshot]
+    per_shard = [future.result() for future in vector_hits]
+    vector_ids = [merge_hits([hits[q] for hits in per_shard], candidates) for q in range(len(queries))]
+    timings["embed"] = embedded - start
+    timings["vector"] = time.perf_counter() - embedded
+    if not HYBRID_SEARCH:
+        return [rrf_scores([ids]) for ids in vector_ids]
+    lexical_ids = [merge_hits([future.result() for future in futures], candidates) for futures in lexical_hits]
+    timings["lexical"] = time.perf_counter() - start  # concurrent with embed + vector
+    start = time.perf_counter()
+    fused = []
+    for vector_ranking, lexical_ranking in zip(vector_ids, lexical_ids):
+        scores = rrf_scores([vector_ranking, lexical_ranking])
+        fused.append(dict(sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]))
+    timings["fuse"] = time.perf_counter() - start
+    return fused
+
+
+def chunk_record(key: tuple) -> dict:
+    number, row = key
+    return get_shards()[number].chunks[row]
+
+
+def corpus_idf(terms: list[str]) -> np.ndarray:
+    """BM25 idf over every shard, so a chunk's coverage score doesn't depend on where it landed."""
+    stats = [shard.lexical.stats(terms) for shard in get_shards()]
+    return LexicalIndex.bm25_idf(sum(n_docs for n_docs, _, _ in stats), sum(df for _, _, df in stats))
+
+
+def corpus_bm25(query: str) -> tuple[dict, float]:
+    """BM25 idf of the query's terms and the average chunk length over every shard, for lexical_search."""
+    terms = list(set(LexicalIndex.tokenize(query)))
+    stats = [shard.lexical.stats(terms) for shard in get_shards()]
+    n_docs = sum(n for n, _, _ in stats)
+    idf = LexicalIndex.bm25_idf(n_docs, sum(df for _, _, df in stats))
+    return dict(zip(terms, idf.tolist())), sum(length for _, length, _ in stats) / max(n_docs, 1)
+
+
+def rerank(query: str, query_vec: np.ndarray, candidates: dict) -> list[tuple[tuple, float]]:
+    """Rescore fused candidates with the NumPy reranker; best RERANK_TOP_K at or above RERANK_MIN_SCORE."""
+    keys = list(candidates)
+    if not keys:
+        return []
+    texts = [chunk_record(key)["chunk"] for key in keys]
+    by_shard = {}
+    for position, (number, _) in enumerate(keys):
+        by_shard.setdefault(number, []).append(position)
+    vectors = np.empty((len(keys), len(query_vec)), dtype=np.float32)
+    for number, positions in by_shard.items():
+        vectors[positions] = get_shards()[number].vectors.take([keys[position][1] for position in positions])
+    scores = rerank_scores(query, query_vec, texts, vectors, corpus_idf, RERANK_CONFIG.get("weights"))
+    order = np.argsort(-scores, kind="stable")[:RERANK_TOP_K]
+    return [(keys[i], float(scores[i])) for i in order if RERANK_MIN_SCORE is None or scores[i] >= RERANK_MIN_SCORE]
+
+
+def run_search(queries: list[str], nprobe: int = None, ef_search: int = None):
+    """
+    Ranked ((shard, id), score) lists per query; None before anything is indexed. Runs
+    retrieval over every shard's current snapshot and the optional rerank stage, and logs
+    the latency of each stage.
+    """
+    snapshot = [(shard, shard.resident.get()[0]) for shard in get_shards()]
+    # A legacy index (no chunk ids, maybe not unit-length) waits for the worker to migrate it
+    snapshot = [(shard, index) for shard, index in snapshot if isinstance(index, faiss.IndexIDMap2)]
+    if not snapshot:
+        ensure_faiss_ready()
+        return None
+    started = time.perf_counter()
+    timings = {}
+    fused = retrieve(snapshot, queries, RERANK_CANDIDATES if RERANK_ENABLED else SEARCH_TOP_K, nprobe, ef_search, timings)
+    if RERANK_ENABLED:
+        start = time.perf_counter()
+        query_vecs = embed_queries(queries)  # cached by retrieve
+        ranked = list(search_pool.map(rerank, queries, query_vecs, fused))
+        timings["rerank"] = time.perf_counter() - start
+    else:
+        ranked = [sorted(scores.items(), key=lambda kv: kv[1], reverse=True) for scores in fused]
+    timings["total"] = time.perf_counter() - started
+    mcp_log("TIMING", f"{len(snapshot)} shards: " + ", ".join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in timings.items()))
+    return ranked
+
+
+NOT_INDEXED = "ERROR: Document index is not built yet; indexing runs in the background (see get_ingestion_status)."
+
+
+def format_extract(data: dict, score: float, extra: str = "") -> str:
+    return f"{data['chunk']}\n[Source: {data['doc']}, ID: {data['chunk_id']}, Score: {score:.4f}{extra}]"
+
+
 @mcp.tool()
-def search_stored_documents(input: SearchDocumentsInput) -> list[str]:
+async def search_stored_documents(input: SearchDocumentsInput) -> list[str]:
     """Search documents to get relevant extracts. Usage: input={"input": {"query": "your query"}} result = await mcp.call_tool('search_stored_documents', input)"""
 
-    ensure_faiss_ready()
     query = input.query
     mcp_log("SEARCH", f"Query: {query}")
     try:
-        index = faiss.read_index(str(ROOT / "faiss_index" / "index.bin"))
-        metadata = json.loads((ROOT / "faiss_index" / "metadata.json").read_text())
-        query_vec = get_embedding(query ).reshape(1, -1)
-        D, I = index.search(query_vec, k=5)
-        results = []
-        for idx in I[0]:
-            data = metadata[idx]
-            results.append(f"{data['chunk']}\n[Source: {data['doc']}, ID: {data['chunk_id']}]")
-        return results
+        ranked = await asyncio.get_running_loop().run_in_executor(
+            query_pool, run_search, [query], input.nprobe, input.ef_search)
+        if ranked is None:
+            return [NOT_INDEXED]
+        return [format_extract(chunk_record(key), score) for key, score in ranked[0]]
     except Exception as e:
         return [f"ERROR: Failed to search: {str(e)}"]
 
 
-def caption_image(img_url_or_path: str) -> str:
-    mcp_log("CAPTION", f"🖼️ Attempting to caption image: {img_url_or_path}")
+@mcp.tool()
+async def search_stored_documents_batch(input: SearchDocumentsBatchInput) -> list[str]:
+    """Search documents for several queries at once; each extract is returned once, tagged with the queries (by position) that found it. Usage: input={"input": {"queries": ["first query", "second query"]}} result = await mcp.call_tool('search_stored_documents_batch', input)"""
+
+    positions = {}  # normalized query -> 1-based positions in input.queries
+    for position, query in enumerate(input.queries, 1):
+        if query.strip():
+            positions.setdefault(normalize_query(query), []).append(position)
+    queries = list(positions)
+    mcp_log("SEARCH", f"Batch of {len(input.queries)} queries ({len(queries)} distinct): {queries}")
+    if not queries:
+        return []
+    try:
+        ranked = await asyncio.get_running_loop().run_in_executor(
+            query_pool, run_search, queries, input.nprobe, input.ef_search)
+        if ranked is None:
+            return [NOT_INDEXED]
+        total, matched = {}, {}
+        for query, hits in zip(queries, ranked):
+            for key, score in hits:
+                total[key] = total.get(key, 0.0) + score  # chunks several queries agree on rank first
+                matched.setdefault(key, []).extend(positions[query])
+        return [
+            format_extract(chunk_record(key), total[key], f", Queries: {', '.join(map(str, sorted(matched[key])))}")
+            for key in sorted(total, key=total.get, reverse=True)
+        ]
+    except Exception as e:
+        return [f"ERROR: Failed to search: {str(e)}"]
 
-    full_path = Path(__file__).parent / "documents" / img_url_or_path
-    full_path = full_path.resolve()
 
-    if not full_path.exists():
-        mcp_log("ERROR", f"❌ Image file not found: {full_path}")
-        return f"[Image file not found: {img_url_or_path}]"
+@mcp.tool()
+def rebuild_index_shard(input: RebuildShardInput) -> list[str]:
+    """Queue a rebuild of one document index shard (or all of them) from its stored vectors, e.g. after changing rag.index in profiles.yaml; searches keep running meanwhile and get_ingestion_status reports the result. Usage: input={"input": {"shard": 0}} result = await mcp.call_tool('rebuild_index_shard', input)"""
+
+    if input.shard is not None and not 0 <= input.shard < SHARD_COUNT:
+        return [f"ERROR: No shard {input.shard}; shards are 0..{SHARD_COUNT - 1}"]
+    targets = get_shards() if input.shard is None else [get_shards()[input.shard]]
+    return [f"Queued rebuild of {shard}" if ingestion.submit(f"rebuild {shard}", rebuild_shard, shard)
+            else f"Rebuild of {shard} is already queued" for shard in targets]
+
+
+@mcp.tool()
+def get_ingestion_status(input: EmptyInput) -> IngestionStatusOutput:
+    """Progress of background document indexing: the running job (stage, files done of total, chunks, failed files), queued jobs and recent results. Usage: input={"input": {}} result = await mcp.call_tool('get_ingestion_status', input)"""
 
+    return IngestionStatusOutput(**ingestion.status())
+
+
+def read_image(img_url_or_path: str):
+    """Image bytes from a URL or a path relative to documents/; None if the local file is missing."""
+    if img_url_or_path.startswith("http"):  # for extract_web_pages
+        result = http.get(img_url_or_path, timeout=30)
+        result.raise_for_status()
+        return result.content
+    full_path = (Path(__file__).parent / "documents" / img_url_or_path).resolve()
+    return full_path.read_bytes() if full_path.exists() else None
+
+
+def is_tiny_image(image: bytes) -> bool:
     try:
-        if img_url_or_path.startswith("http"): # for extract_web_pages
-            result = requests.get(img_url_or_path)
-            encoded_image = base64.b64encode(result.content).decode("utf-8")
-        else:
-            with open(full_path, "rb") as img_file:
-                encoded_image = base64.b64encode(img_file.read()).decode("utf-8")
-
-        # Set stream=True to get the full generator-style output
-        with requests.post(OLLAMA_URL, json={
-            "model": GEMMA_MODEL,
-            "prompt": "If there is lot of text in the image, then ONLY reply back with exact text in the image, else Describe the image such that your result can replace 'alt-text' for it. Only explain the contents of the image and provide no further explaination.",
-            "images": [encoded_image],
-            "stream": True
-        }, stream=True) as result:
-
-            caption_parts = []
-            for line in result.iter_lines():
-                if not line:
-                    continue
-                try:
-                    data = json.loads(line)
-                    caption_parts.append(data.get("result", ""))
-                    if data.get("done", False):
-                        break
-                except json.JSONDecodeError:
-                    continue  # silently skip malformed lines
+        width, height = PILImage.open(io.BytesIO(image)).size
+    except Exception:
+        return False  # let the model have a go at formats PIL can't read
+    return min(width, height) < MIN_CAPTION_SIDE
+
+
+def caption_key(image: bytes) -> str:
+    return ResponseCache.make_key(GEMMA_MODEL, CAPTION_PROMPT, {"image": hashlib.sha256(image).hexdigest()})
+
+
+def caption_bytes(image: bytes) -> str:
+    """Caption an image with gemma3, reusing the cached caption for identical image bytes."""
+    key = caption_key(image)
+    cached = get_caption_cache().get(key)
+    if cached is not None:
+        return cached
+
+    encoded_image = base64.b64encode(image).decode("utf-8")
+    # Set stream=True to get the full generator-style output
+    with _caption_slots, requests.post(OLLAMA_URL, json={
+        "model": GEMMA_MODEL,
+        "prompt": CAPTION_PROMPT,
+        "images": [encoded_image],
+        "stream": True
+    }, stream=True, timeout=CAPTION_TIMEOUT) as result:
+        result.raise_for_status()
+        caption_parts = []
+        for line in result.iter_lines():
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+                caption_parts.append(data.get("response", ""))
+                if data.get("done", False):
+                    break
+            except json.JSONDecodeError:
+                continue  # silently skip malformed lines
+
+    caption = "".join(caption_parts).strip()
+    if caption:
+        get_caption_cache().put(key, caption)
+    return caption
 
-            caption = "".join(caption_parts).strip()
-            mcp_log("CAPTION", f"✅ Caption generated: {caption}")
-            return caption if caption else "[No caption returned]"
 
+def caption_image(img_url_or_path: str) -> str:
+    mcp_log("CAPTION", f"🖼️ Attempting to caption image: {img_url_or_path}")
+    try:
+        image = read_image(img_url_or_path)
+        if image is None:
+            mcp_log("ERROR", f"❌ Image file not found: {img_url_or_path}")
+            return f"[Image file not found: {img_url_or_path}]"
+        caption = caption_bytes(image)
+        mcp_log("CAPTION", f"✅ Caption generated: {caption}")
+        return caption if caption else "[No caption returned]"
     except Exception as e:
         mcp_log("ERROR", f"⚠️ Failed to caption image {img_url_or_path}: {e}")
         return f"[Image could not be processed: {img_url_or_path}]"
 
 
-
-
-
 def replace_images_with_captions(markdown: str) -> str:
-    def replace(match):
-        alt, src = match.group(1), match.group(2)
+    """
+    Replace every markdown image with its caption. Images are read CAPTION_CONCURRENCY
+    at a time and captioned under the shared _caption_slots cap; each distinct image is
+    captioned once and repeats such as page logos get the same caption, while images
+    under MIN_CAPTION_SIDE are dropped without a model call.
+    """
+    matches = list(re.finditer(r'!\[(.*?)\]\((.*?)\)', markdown))
+    if not matches:
+        return markdown
+    sources = list(dict.fromkeys(match.group(2) for match in matches))
+
+    def load(src):
+        try:
+            return read_image(src)
+        except Exception as e:
+            mcp_log("WARN", f"Could not read image {src}: {e}")
+            return None
+
+    def caption(image):
         try:
-            caption = caption_image(src)
-            # Attempt to delete only if local and file exists
-            if not src.startswith("http"):
-                img_path = Path(__file__).parent / "documents" / src
-                if img_path.exists():
-                    img_path.unlink()
-                    mcp_log("INFO", f"🗑️ Deleted image after captioning: {img_path}")
-            return f"**Image:** {caption}"
+            return caption_bytes(image) or "[No caption returned]"
         except Exception as e:
-            mcp_log("WARN", f"Image deletion failed: {e}")
+            mcp_log("ERROR", f"⚠️ Failed to caption image: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=CAPTION_CONCURRENCY) as pool:
+        images = dict(zip(sources, pool.map(load, sources)))
+        digests = {src: hashlib.sha256(image).hexdigest() for src, image in images.items() if image is not None}
+        unique = {}
+        for src, digest in digests.items():
+            if digest not in unique and not is_tiny_image(images[src]):
+                unique[digest] = images[src]
+        captions = dict(zip(unique, pool.map(caption, unique.values())))
+    mcp_log("CAPTION", f"Captioned {len(unique)} distinct images out of {len(matches)} references")
+
+    # Attempt to delete only if local and file exists
+    for src in sources:
+        if not src.startswith("http") and images.get(src) is not None:
+            img_path = Path(__file__).parent / "documents" / src
+            try:
+                img_path.unlink()
+                mcp_log("INFO", f"🗑️ Deleted image after captioning: {img_path}")
+            except OSError as e:
+                mcp_log("WARN", f"Image deletion failed: {e}")
+
+    def replace(match):
+        src = match.group(2)
+        digest = digests.get(src)
+        if digest is None:
+            return f"[Image could not be processed: {src}]"
+        if digest not in captions:
+            return ""  # tiny image
+        if captions[digest] is None:
             return f"[Image could not be processed: {src}]"
+        return f"**Image:** {captions[digest]}"
 
     return re.sub(r'!\[(.*?)\]\((.*?)\)', replace, markdown)
 
@@ -190,18 +1041,10 @@ def replace_images_with_captions(markdown: str) -> str:
 def convert_webpage_url_into_markdown(input: UrlInput) -> MarkdownOutput:
     """Return clean webpage content without Ads, and clutter. Usage: input={{"input": {{"url": "https://example.com"}}}} result = await mcp.call_tool('convert_webpage_url_into_markdown', input)"""
 
-    downloaded = trafilatura.fetch_url(input.url)
-    if not downloaded:
+    markdown = webpage_markdown(input.url)
+    if markdown is None:
         return MarkdownOutput(markdown="Failed to download the webpage.")
 
-    markdown = trafilatura.extract(
-        downloaded,
-        include_comments=False,
-        include_tables=True,
-        include_images=True,
-        output_format='markdown'
-    ) or ""
-
     markdown = replace_images_with_captions(markdown)
     return MarkdownOutput(markdown=markdown)
 
@@ -213,25 +1056,7 @@ def extract_pdf(input: FilePathInput) -> MarkdownOutput:
     if not os.path.exists(input.file_path):
         return MarkdownOutput(markdown=f"File not found: {input.file_path}")
 
-    ROOT = Path(__file__).parent.resolve()
-    global_image_dir = ROOT / "documents" / "images"
-    global_image_dir.mkdir(parents=True, exist_ok=True)
-
-    # Actual markdown with relative image paths
-    markdown = pymupdf4llm.to_markdown(
-        input.file_path,
-        write_images=True,
-        image_path=str(global_image_dir)
-    )
-
-    # Re-point image links in the markdown
-    markdown = re.sub(
-        r'!\[\]\((.*?/images/)([^)]+)\)',
-        r'![](images/\2)',
-        markdown.replace("\\", "/")
-    )
-
-    markdown = replace_images_with_captions(markdown)
+    markdown = replace_images_with_captions(pdf_markdown(input.file_path))
     return MarkdownOutput(markdown=markdown)
 
 
@@ -305,100 +1130,287 @@ Keep markdown formatting intact.
 
 
 
-def process_documents():
-    """Process documents and create FAISS index using unified multimodal strategy."""
-    mcp_log("INFO", "Indexing documents with unified RAG pipeline...")
-    ROOT = Path(__file__).parent.resolve()
-    DOC_PATH = ROOT / "documents"
-    INDEX_CACHE = ROOT / "faiss_index"
-    INDEX_CACHE.mkdir(exist_ok=True)
-    INDEX_FILE = INDEX_CACHE / "index.bin"
-    METADATA_FILE = INDEX_CACHE / "metadata.json"
-    CACHE_FILE = INDEX_CACHE / "doc_index_cache.json"
-
-    def file_hash(path):
-        return hashlib.md5(Path(path).read_bytes()).hexdigest()
-
-    CACHE_META = json.loads(CACHE_FILE.read_text()) if CACHE_FILE.exists() else {}
-    metadata = json.loads(METADATA_FILE.read_text()) if METADATA_FILE.exists() else []
-    index = faiss.read_index(str(INDEX_FILE)) if INDEX_FILE.exists() else None
-
-    for file in DOC_PATH.glob("*.*"):
-        fhash = file_hash(file)
-        if file.name in CACHE_META and CACHE_META[file.name] == fhash:
-            mcp_log("SKIP", f"Skipping unchanged file: {file.name}")
-            continue
+def file_stat(path) -> list:
+    """(size, mtime_ns, inode): if all three match the cache, the file is taken as unchanged without reading it."""
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
 
-        mcp_log("PROC", f"Processing: {file.name}")
-        try:
-            ext = file.suffix.lower()
-            markdown = ""
 
-            if ext == ".pdf":
-                mcp_log("INFO", f"Using MuPDF4LLM to extract {file.name}")
-                markdown = extract_pdf(FilePathInput(file_path=str(file))).markdown
+def file_hash(path) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-            elif ext in [".html", ".htm", ".url"]:
-                mcp_log("INFO", f"Using Trafilatura to extract {file.name}")
-                markdown = extract_webpage(UrlInput(url=file.read_text().strip())).markdown
 
-            else:
-                # Fallback to MarkItDown for other formats
-                converter = MarkItDown()
-                mcp_log("INFO", f"Using MarkItDown fallback for {file.name}")
-                markdown = converter.convert(str(file)).text_content
+def scan_documents(doc_path: Path) -> dict:
+    """File name -> stat tuple for every document, from directory metadata only."""
+    return {entry.name: file_stat(entry.path) for entry in os.scandir(doc_path)
+            if entry.is_file() and "." in entry.name}
 
-            if not markdown.strip():
-                mcp_log("WARN", f"No content extracted from {file.name}")
-                continue
-
-            if len(markdown.split()) < 10:
-                mcp_log("WARN", f"Content too short for semantic merge in {file.name} → Skipping chunking.")
-                chunks = [markdown.strip()]
-            else:
-                mcp_log("INFO", f"Running semantic merge on {file.name} with {len(markdown.split())} words")
-                chunks = semantic_merge(markdown)
-
-
-            embeddings_for_file = []
-            new_metadata = []
-            for i, chunk in enumerate(tqdm(chunks, desc=f"Embedding {file.name}")):
-                embedding = get_embedding(chunk)
-                embeddings_for_file.append(embedding)
-                new_metadata.append({
-                    "doc": file.name,
-                    "chunk": chunk,
-                    "chunk_id": f"{file.stem}_{i}"
-                })
-
-            if embeddings_for_file:
-                if index is None:
-                    dim = len(embeddings_for_file[0])
-                    index = faiss.IndexFlatL2(dim)
-                index.add(np.stack(embeddings_for_file))
-                metadata.extend(new_metadata)
-                CACHE_META[file.name] = fhash
-
-                # ✅ Immediately save index and metadata
-                CACHE_FILE.write_text(json.dumps(CACHE_META, indent=2))
-                METADATA_FILE.write_text(json.dumps(metadata, indent=2))
-                faiss.write_index(index, str(INDEX_FILE))
-                mcp_log("SAVE", f"Saved FAISS index and metadata after processing {file.name}")
 
+def watch_documents(interval: float):
+    """Queue a document scan whenever a file in documents/ is added, changed or removed."""
+    doc_path = ROOT / "documents"
+    mcp_log("INFO", f"Watching {doc_path} for changes every {interval}s")
+    seen = scan_documents(doc_path)
+    while True:
+        time.sleep(interval)
+        try:
+            current = scan_documents(doc_path)
+            if current != seen:
+                seen = current
+                ingestion.submit("scan", process_documents)
         except Exception as e:
-            mcp_log("ERROR", f"Failed to process {file.name}: {e}")
+            mcp_log("ERROR", f"Document watch failed: {e}")
+
+
+def pack_semantic_units(units: list) -> list[str]:
+    """Embed semantic-mode units here, under the shared request cap, and pack them into chunks."""
+    vectors = get_embeddings([unit.text for unit in units]) if len(units) >= 3 else None
+    return semantic_pack(units, vectors, breakpoint_percentile=CHUNK_CONFIG.get("breakpoint_percentile", 25.0),
+                         **CHUNK_PARAMS)
+
+
+def chunk_markdown(markdown: str, mode: str) -> list[str]:
+    """Split markdown with the given rag.chunking mode: llm (semantic_merge), markdown or semantic."""
+    if mode == "llm":
+        return semantic_merge(markdown)
+    if mode == "markdown":
+        return markdown_chunks(markdown, **CHUNK_PARAMS)
+    return pack_semantic_units(markdown_units(markdown, CHUNK_PARAMS.get("max_words", 400)))
+
+
+def chunk_document(name: str, markdown: str) -> list[str]:
+    """Chunks of a document, in the rag.chunking mode configured for its file name."""
+    if not markdown.strip():
+        return []
+    if len(markdown.split()) < 10:
+        mcp_log("WARN", f"Content too short for semantic merge in {name} → Skipping chunking.")
+        return [markdown.strip()]
+    mode = chunk_mode_for(name, CHUNK_CONFIG)
+    mcp_log("INFO", f"Chunking {name} ({len(markdown.split())} words) in {mode} mode")
+    return chunk_markdown(markdown, mode)
+
+
+def _embed_stage(file: Path, extracted: Future, out: Future) -> None:
+    """
+    Ingestion stage 2, in this process: caption, chunk and embed a file as soon as its
+    extraction finishes. Every Ollama call of ingestion is made here, so no file's
+    captions, phi4 chunking or embeddings escape the caps that bound them.
+    """
+    try:
+        result = extracted.result()
+        start = time.perf_counter()
+        markdown = result.pop("markdown")
+        if file.suffix.lower() in CAPTIONED_TYPES:
+            markdown = replace_images_with_captions(markdown)
+        captioned = time.perf_counter()
+        result["chunks"] = chunk_document(file.name, markdown)
+        result["caption"] = captioned - start
+        result["chunk"] = time.perf_counter() - captioned
+        start = time.perf_counter()
+        result["embeddings"] = get_embeddings(result["chunks"])
+        result["embed"] = time.perf_counter() - start
+        out.set_result(result)
+    except BaseException as e:
+        out.set_exception(e)
 
 
+def process_documents():
+    """
+    Process documents and create FAISS index using unified multimodal strategy.
+
+    Each document belongs to shard shard_of(name). Changed files are converted to markdown
+    in a process pool, captioned, chunked and embedded by a bounded thread stage in this
+    process (EMBED_FILES_IN_FLIGHT files, EMBED_CONCURRENCY embedding requests overall),
+    and committed by this thread alone, in file order, publishing only the shard that changed.
+    """
+    mcp_log("INFO", f"Indexing documents with unified RAG pipeline into {SHARD_COUNT} shard(s)...")
+    ROOT = Path(__file__).parent.resolve()
+    DOC_PATH = ROOT / "documents"
+    INDEX_DIR.mkdir(exist_ok=True)
+    ingestion.report(stage="loading shards")
+
+    # Shards beyond rag.shards (it was lowered) are emptied into the ones that remain
+    shards = get_shards()
+    retired = [Shard(int(path.name[6:])) for path in sorted(INDEX_DIR.glob("shard_*"))
+               if path.is_dir() and path.name[6:].isdigit() and int(path.name[6:]) >= SHARD_COUNT]
+    moving = []
+    for shard in shards + retired:
+        with shard.lock:
+            moving += load_shard(shard, DOC_PATH)
+    for shard in retired:
+        shard.chunks.close()
+        shutil.rmtree(shard.directory)
+        mcp_log("INFO", f"Removed {shard} (rag.shards is {SHARD_COUNT})")
+    for name, entry, records, vectors in moving:
+        shard = shards[shard_of(name)]
+        with shard.lock:
+            commit_document(shard, name, entry, records, vectors)
+
+    ingestion.report(stage="scanning documents")
+    pending = []
+    restamped = set()
+    for name, stat in sorted(scan_documents(DOC_PATH).items()):
+        file = DOC_PATH / name
+        shard = shards[shard_of(name)]
+        entry = shard.manifest.get(name)
+        if entry is not None and entry.get("stat") == stat:
+            mcp_log("SKIP", f"Skipping unchanged file: {name}")
+            continue
+        fhash = file_hash(file)  # stat changed (or was never recorded): only now read the bytes
+        if entry is not None and entry["hash"] == fhash:
+            entry["stat"] = stat  # touched or copied, same content
+            restamped.add(shard)
+            mcp_log("SKIP", f"Skipping unchanged file: {name}")
+            continue
+        pending.append((file, fhash, stat))
+    for shard in restamped:
+        with shard.lock:
+            write_atomic(shard.manifest_file, lambda p: p.write_text(json.dumps(shard.manifest, indent=2)))
+    if not pending:
+        log_index_footprint()
+        return
+
+    workers = min(INGEST_WORKERS, len(pending))
+    mcp_log("INFO", f"Ingesting {len(pending)} files with {workers} extraction workers")
+    started = time.perf_counter()
+    totals = {"extract": 0.0, "caption": 0.0, "chunk": 0.0, "embed": 0.0, "commit": 0.0}
+    n_chunks = 0
+    failed = []
+    ingestion.report(stage="ingesting", files_total=len(pending), files_done=0, chunks=0, failed=[])
+
+    # spawn, not fork: this process already runs the MCP server thread
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as extract_pool, \
+            ThreadPoolExecutor(EMBED_FILES_IN_FLIGHT) as embed_pool:
+        embedded = []
+        for file, _, _ in pending:
+            out = Future()
+            extract_pool.submit(extract_markdown, str(file)).add_done_callback(
+                lambda extracted, file=file, out=out: embed_pool.submit(_embed_stage, file, extracted, out))
+            embedded.append(out)
+
+        for n, ((file, fhash, stat), future) in enumerate(zip(pending, embedded), 1):
+            try:
+                result = future.result()
+                shard = shards[shard_of(file.name)]
+                embeddings_for_file = result["embeddings"]
+                if not len(embeddings_for_file):
+                    mcp_log("WARN", f"No content extracted from {file.name}")
+                    # Remember it, so an unchanged empty file isn't extracted again on every scan
+                    with shard.lock:
+                        commit_document(shard, file.name, {"hash": fhash, "stat": stat}, [], embeddings_for_file)
+                    continue
+
+                commit_start = time.perf_counter()
+                new_records = [
+                    {"doc": file.name, "chunk": chunk, "chunk_id": f"{file.stem}_{i}"}
+                    for i, chunk in enumerate(result["chunks"])
+                ]
+                with shard.lock:
+                    commit_document(shard, file.name, {"hash": fhash, "stat": stat}, new_records, embeddings_for_file)
+                result["commit"] = time.perf_counter() - commit_start
+
+                for stage in totals:
+                    totals[stage] += result[stage]
+                n_chunks += len(new_records)
+                mcp_log("SAVE", f"[{n}/{len(pending)}] {file.name} -> {shard}: {len(new_records)} chunks "
+                                f"(extract {result['extract']:.2f}s, caption {result['caption']:.2f}s, chunk {result['chunk']:.2f}s, "
+                                f"embed {result['embed']:.2f}s, commit {result['commit']:.2f}s)")
+
+            except Exception as e:
+                mcp_log("ERROR", f"Failed to process {file.name}: {e}")
+                failed.append(file.name)
+            finally:
+                ingestion.report(files_done=n, chunks=n_chunks, failed=list(failed))
+
+    elapsed = time.perf_counter() - started
+    mcp_log("INFO", f"Ingested {n_chunks} chunks from {len(pending)} files in {elapsed:.2f}s; stage totals: "
+                    + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in totals.items()))
+    log_index_footprint()
+    stored = sum(len(shard.chunks) for shard in shards)
+    dead = stored - sum(shard.index.ntotal for shard in shards if shard.index is not None)
+    if dead > stored - dead:
+        mcp_log("INFO", f"{dead} of {stored} stored chunks are from replaced or deleted files; "
+                        f"run `python mcp_server_2.py compact` while the server is stopped to reclaim them")
+
+
+
+class IngestionWorker:
+    """
+    Runs ingestion jobs (document scans, shard rebuilds) one at a time on a dedicated
+    thread, so the MCP server never indexes on its own threads. Every index change is
+    published by an atomic rename and searches read the last published snapshot, so
+    they are never blocked or handed a half-written index. A job that raises is logged
+    and recorded in status(); the worker and the server carry on. Submitting a job
+    that is already queued is a no-op, so a burst of file changes costs one scan.
+    """
+
+    def __init__(self, history: int = 20):
+        self._cond = threading.Condition()
+        self._queue = []  # (label, func, args), oldest first
+        self._thread = None
+        self.current = None  # the running job's label, start time and progress
+        self.history = deque(maxlen=history)
+
+    def submit(self, label: str, func, *args) -> bool:
+        """Queue func(*args) as `label`; False if a job with that label is already waiting."""
+        with self._cond:
+            if any(queued == label for queued, _, _ in self._queue):
+                return False
+            self._queue.append((label, func, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ingestion", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+            return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                label, func, args = self._queue.pop(0)
+                self.current = {"job": label, "started": time.strftime("%Y-%m-%d %H:%M:%S")}
+            start = time.perf_counter()
+            try:
+                result = func(*args)
+                outcome = {"status": "done"} if result is None else {"status": "done", "result": result}
+            except Exception as e:
+                mcp_log("ERROR", f"Ingestion job '{label}' failed: {e}")
+                traceback.print_exc(file=sys.stderr)
+                outcome = {"status": "failed", "error": str(e)}
+            with self._cond:
+                self.history.append({**self.current, **outcome, "seconds": round(time.perf_counter() - start, 2)})
+                self.current = None
+
+    def pending(self, label: str) -> bool:
+        """True if a job with this label is queued or running."""
+        with self._cond:
+            return (self.current or {}).get("job") == label or any(queued == label for queued, _, _ in self._queue)
+
+    def report(self, **progress):
+        """Merge progress into the running job's status; a no-op outside a job."""
+        with self._cond:
+            if self.current is not None:
+                self.current.update(progress)
+
+    def status(self) -> dict:
+        with self._cond:
+            return {"running": dict(self.current) if self.current else None,
+                    "queued": [label for label, _, _ in self._queue],
+                    "recent": list(self.history)[::-1]}
+
+
+ingestion = IngestionWorker()
+
 
 def ensure_faiss_ready():
-    from pathlib import Path
-    index_path = ROOT / "faiss_index" / "index.bin"
-    meta_path = ROOT / "faiss_index" / "metadata.json"
-    if not (index_path.exists() and meta_path.exists()):
-        mcp_log("INFO", "Index not found — running process_documents()...")
-        process_documents()
-    else:
-        mcp_log("INFO", "Index already exists. Skipping regeneration.")
+    """Nothing searchable yet: queue a scan for the ingestion worker unless one is already queued or running."""
+    if not ingestion.pending("scan") and ingestion.submit("scan", process_documents):
+        mcp_log("INFO", "Index not found — queued a document scan")
 
 
 if __name__ == "__main__":
@@ -406,22 +1418,17 @@ if __name__ == "__main__":
 
     if len(sys.argv) > 1 and sys.argv[1] == "dev":
         mcp.run() # Run without transport for dev server
+    elif len(sys.argv) > 1 and sys.argv[1] == "compact":
+        compact_index()
+    elif len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+        for number in map(int, sys.argv[2:]) if len(sys.argv) > 2 else range(SHARD_COUNT):
+            mcp_log("INFO", rebuild_shard(get_shards()[number]))
     else:
-        # Start the server in a separate thread
-        import threading
-        server_thread = threading.Thread(target=lambda: mcp.run(transport="stdio"))
-        server_thread.daemon = True
-        server_thread.start()
-        
-        # Wait a moment for the server to start
-        time.sleep(2)
-        
-        # Process documents after server is running
-        process_documents()
-        
-        # Keep the main thread alive
+        # Index in the background; the server owns the main thread and answers from the last published index
+        ingestion.submit("scan", process_documents)
+        if WATCH_INTERVAL:
+            threading.Thread(target=watch_documents, args=(WATCH_INTERVAL,), name="watch", daemon=True).start()
         try:
-            while True:
-                time.sleep(1)
+            mcp.run(transport="stdio")
         except KeyboardInterrupt:
             print("\nShutting down...")
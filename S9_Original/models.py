@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import Any, Dict, List, Optional
 
 # --- Math Tools ---
 
@@ -163,6 +163,21 @@ class SearchInput(BaseModel):
 
 class SearchDocumentsInput(BaseModel):
     query: str
+    nprobe: Optional[int] = None      # IVF cells to probe; defaults to rag.index.nprobe
+    ef_search: Optional[int] = None   # HNSW search breadth; defaults to rag.index.ef_search
+
+class SearchDocumentsBatchInput(BaseModel):
+    queries: List[str]
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+class RebuildShardInput(BaseModel):
+    shard: Optional[int] = None       # shard number; None rebuilds every shard, one at a time
+
+class IngestionStatusOutput(BaseModel):
+    running: Optional[Dict[str, Any]] = None   # job, start time, stage, files_done/files_total, chunks, failed
+    queued: List[str] = []
+    recent: List[Dict[str, Any]] = []          # finished jobs, newest first, with status and duration
 
 class UrlInput(BaseModel):
     url: str
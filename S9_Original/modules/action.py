@@ -45,6 +45,21 @@ async def run_python_sandbox(code: str, dispatcher: Any) -> str:
                 result = await self.dispatcher.call_tool(tool_name, input_dict)
                 return result
 
+            async def call_tools(self, calls: list, return_exceptions: bool = False) -> list:
+                """Run independent (tool_name, input_dict) calls concurrently; results come back in call order."""
+                calls = [tuple(call) for call in calls]
+                if self.call_count + len(calls) > MAX_TOOL_CALLS_PER_PLAN:
+                    raise RuntimeError(
+                        f"Batch of {len(calls)} tool calls would exceed max tool calls "
+                        f"({MAX_TOOL_CALLS_PER_PLAN}) in solve() plan ({self.call_count} already used)."
+                    )
+                self.call_count += len(calls)
+                log("sandbox", f"Dispatching {len(calls)} tool calls concurrently: {[name for name, _ in calls]}")
+                return await asyncio.gather(
+                    *(self.dispatcher.call_tool(tool_name, input_dict) for tool_name, input_dict in calls),
+                    return_exceptions=return_exceptions,
+                )
+
         sandbox.mcp = SandboxMCP(dispatcher)
 
         # Preload safe built-ins into the sandbox
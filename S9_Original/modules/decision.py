@@ -3,6 +3,8 @@ from modules.perception import PerceptionResult
 from modules.memory import MemoryItem
 from modules.model_manager import ModelManager
 from modules.tools import load_prompt
+from contextlib import aclosing
+import time
 import re
 
 # Optional logging fallback
@@ -16,6 +18,98 @@ except ImportError:
 
 model = ModelManager()
 
+STREAM_PLANS = model.profile["llm"].get("stream_plans", False)
+EARLY_ABORT_CHARS = 600  # give up on a streamed plan if no solve() has appeared by then
+SOLVE_DEF_RE = re.compile(r"^\s*(async\s+)?def\s+solve\s*\(")
+TOP_LEVEL_CODE_RE = re.compile(r"^(async\s+def|def|class|import|from|@|#|if\s|\w+\s*=)")
+
+
+class PlanStreamParser:
+    """
+    Follows a plan as it streams in, line by line.
+    feed() returns "invalid" once enough text has arrived without a solve() definition,
+    "complete" once the solve() body has been closed by a dedented non-code line
+    (usually the closing ``` fence), and "continue" otherwise.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.plan = None  # text up to the end of solve(), set on "complete"
+        self._pos = 0
+        self._solve_indent = None
+        self._in_body = False
+
+    def feed(self, chunk: str) -> str:
+        self.text += chunk
+        while True:
+            end = self.text.find("\n", self._pos)
+            if end == -1:
+                break
+            line_start, line = self._pos, self.text[self._pos:end]
+            self._pos = end + 1
+
+            if self._solve_indent is None:
+                if SOLVE_DEF_RE.match(line):
+                    self._solve_indent = len(line) - len(line.lstrip())
+                continue
+            if not line.strip():
+                continue
+
+            indent = len(line) - len(line.lstrip())
+            if indent > self._solve_indent:
+                self._in_body = True
+                continue
+            stripped = line.lstrip()
+            if self._in_body and (stripped.startswith("```") or not TOP_LEVEL_CODE_RE.match(stripped)):
+                self.plan = self.text[:line_start]
+                return "complete"
+
+        if self._solve_indent is None and len(self.text.strip()) > EARLY_ABORT_CHARS:
+            return "invalid"
+        return "continue"
+
+
+def strip_code_fence(raw: str) -> str:
+    # If fenced in ```python ... ```, extract
+    if raw.startswith("```"):
+        raw = raw.strip("`").strip()
+        if raw.lower().startswith("python"):
+            raw = raw[len("python"):].strip()
+    return raw
+
+
+async def stream_plan(prompt: str, use_cache: bool = True, refresh_cache: bool = False) -> str:
+    """Stream the plan, stopping as soon as solve() is complete and compiles, or is clearly missing."""
+    parser = PlanStreamParser()
+    started = time.perf_counter()
+    first_token = None
+
+    stream = model.stream_text(prompt, use_cache=use_cache, refresh_cache=refresh_cache)
+    async with aclosing(stream):
+        async for chunk in stream:
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            status = parser.feed(chunk)
+
+            if status == "invalid":
+                log("plan", f"⚠️ No solve() within {len(parser.text)} chars — aborting generation early")
+                return parser.text.strip()
+
+            if status == "complete":
+                plan = parser.plan.strip()
+                try:
+                    compile(strip_code_fence(plan), "<solve_plan>", "exec")
+                except SyntaxError:
+                    parser.plan = None  # dedent was inside the body after all; keep streaming
+                    continue
+                if use_cache:
+                    model.remember(prompt, plan)
+                log("plan", f"solve() complete after {time.perf_counter() - started:.2f}s "
+                            f"(first token {first_token:.2f}s) — stopped stream early")
+                return plan
+
+    return parser.text.strip()
+
 
 # prompt_path = "prompts/decision_prompt.txt"
 
@@ -27,11 +121,14 @@ async def generate_plan(
     prompt_path: str,
     step_num: int = 1,
     max_steps: int = 3,
+    use_cache: bool = True,
+    refresh_cache: bool = False,
 ) -> str:
 
-    """Generates the full solve() function plan for the agent."""
-
-    memory_texts = "\n".join(f"- {m.text}" for m in memory_items) or "None"
+    """Generates the full solve() function plan for the agent.
+    Pass refresh_cache=True on retries so a failed plan isn't served again from the LLM cache,
+    and use_cache=False when the prompt can't tell this plan apart from an earlier one
+    (later steps of a run) so neither is served nor stored in place of the other."""
 
     prompt_template = load_prompt(prompt_path)
 
@@ -42,14 +139,13 @@ async def generate_plan(
 
 
     try:
-        raw = (await model.generate_text(prompt)).strip()
+        if STREAM_PLANS:
+            raw = await stream_plan(prompt, use_cache=use_cache, refresh_cache=refresh_cache)
+        else:
+            raw = (await model.generate_text(prompt, use_cache=use_cache, refresh_cache=refresh_cache)).strip()
         log("plan", f"LLM output: {raw}")
 
-        # If fenced in ```python ... ```, extract
-        if raw.startswith("```"):
-            raw = raw.strip("`").strip()
-            if raw.lower().startswith("python"):
-                raw = raw[len("python"):].strip()
+        raw = strip_code_fence(raw)
 
         if re.search(r"^\s*(async\s+)?def\s+solve\s*\(", raw, re.MULTILINE):
             return raw  # ✅ Correct, it's a full function
@@ -0,0 +1,114 @@
+# modules/llm_cache.py
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+
+class ResponseCache:
+    """
+    Two-tier cache for LLM responses.
+    Keys are derived from (model, prompt hash, generation params); values expire
+    after `ttl` seconds. The in-memory tier is an LRU capped at `max_entries`;
+    the optional SQLite tier survives restarts and is capped at `max_persistent_entries`.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: float = 3600.0,
+        sqlite_path: Optional[str] = None,
+        max_persistent_entries: int = 5000,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_persistent_entries = max_persistent_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, response)
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        self._db = None
+        if sqlite_path:
+            Path(sqlite_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(model: str, prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        raw = json.dumps({"model": model, "prompt": prompt_hash, "params": params or {}}, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row[1], row[0])
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, response)
+            self.stats["stores"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, response, expires_at, now),
+                )
+                self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+                self._db.execute(
+                    "DELETE FROM responses WHERE key NOT IN "
+                    "(SELECT key FROM responses ORDER BY accessed_at DESC LIMIT ?)",
+                    (self.max_persistent_entries,),
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, expires_at: float, response: str):
+        self._memory[key] = (expires_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
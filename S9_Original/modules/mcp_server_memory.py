@@ -4,8 +4,12 @@ from datetime import datetime
 import yaml
 from memory import MemoryManager  # Import MemoryManager to use its path structure
 import json
+import math
+import hashlib
 import os
+import re
 import sys
+import time
 import signal
 from pydantic import BaseModel  # Add this import
 
@@ -113,8 +117,192 @@ class MemoryStore:
             "timestamp_end": interactions[-1].get("timestamp") if interactions else None
         }
 
+class MemoryIndex:
+    """
+    Persistent BM25 inverted index over user_query, final_answer and intent of all
+    session items. Each session (snapshot + journal, see read_session_items) is kept as
+    one segment file in .search_index/ and tracked by the (mtime_ns, size) of its files,
+    so a changed session re-reads and rewrites only its own segment: a live session's
+    journal costs O(session) per refresh, never a rewrite of the whole index.
+    """
+
+    INDEXED_FIELDS = ("user_query", "final_answer", "intent")
+    RETURNED_FIELDS = ("user_query", "final_answer", "timestamp", "intent")
+    K1 = 1.5
+    B = 0.75
+    REFRESH_INTERVAL = 2.0  # seconds between directory re-scans
+
+    def __init__(self, memory_dir: str):
+        self.memory_dir = memory_dir
+        self.segment_dir = os.path.join(memory_dir, ".search_index")
+        self.sessions: Dict[str, Dict[str, Any]] = {}  # rel session path -> {stamp, docs}
+        self.docs: Dict[str, Dict[str, Any]] = {}      # doc id -> returned fields + length
+        self.postings: Dict[str, Dict[str, int]] = {}  # term -> {doc id: term frequency}
+        self.total_length = 0
+        self._last_refresh = 0.0
+        self._load()
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return re.findall(r"\w+", text.lower())
+
+    def _segment_path(self, session: str) -> str:
+        return os.path.join(self.segment_dir, hashlib.md5(session.encode("utf-8")).hexdigest() + ".json")
+
+    def _load(self):
+        if os.path.isfile(self.segment_dir):
+            os.remove(self.segment_dir)  # single-file index of earlier versions; rebuilt as segments
+        os.makedirs(self.segment_dir, exist_ok=True)
+        for name in os.listdir(self.segment_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.segment_dir, name), "r", encoding="utf-8") as f:
+                    segment = json.load(f)
+                self._add_session(segment["session"], segment["stamp"], segment["items"])
+            except Exception as e:
+                print(f"[memory] Re-indexing unreadable search segment {name}: {e}")
+
+    def _write_segment(self, session: str, stamp: Dict, items: List[Dict]):
+        path = self._segment_path(session)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"session": session, "stamp": stamp, "items": items}, f)
+        os.replace(tmp_path, path)
+
+    def _remove_session(self, session: str):
+        for doc_id in self.sessions.pop(session, {}).get("docs", []):
+            doc = self.docs.pop(doc_id, None)
+            if doc is None:
+                continue
+            self.total_length -= doc["length"]
+            for term in doc["terms"]:
+                postings = self.postings.get(term, {})
+                postings.pop(doc_id, None)
+                if not postings:
+                    self.postings.pop(term, None)
+
+    def _add_session(self, session: str, stamp: Dict, items: List[Dict]):
+        doc_ids = []
+        for i, item in enumerate(items):
+            text = " ".join(str(item.get(field) or "") for field in self.INDEXED_FIELDS)
+            tokens = self.tokenize(text)
+            if not tokens:
+                continue
+            doc_id = f"{session}#{i}"
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+            self.docs[doc_id] = {**item, "length": len(tokens), "terms": list(counts)}
+            self.total_length += len(tokens)
+            doc_ids.append(doc_id)
+        self.sessions[session] = {"stamp": stamp, "docs": doc_ids}
+
+    def _read_session(self, session: str) -> List[Dict]:
+        """The returned fields of every item in a session, in order."""
+        try:
+            items = read_session_items(os.path.join(self.memory_dir, session))
+        except Exception as e:
+            print(f"Failed to load {session}: {e}")
+            items = []
+        return [{field: item.get(field, "") for field in self.RETURNED_FIELDS} if isinstance(item, dict) else {}
+                for item in items]
+
+    def refresh(self, force: bool = False):
+        """Re-index sessions whose files' (mtime_ns, size) changed and drop deleted ones."""
+        if not force and time.monotonic() - self._last_refresh < self.REFRESH_INTERVAL:
+            return
+        self._last_refresh = time.monotonic()
+
+        stamps: Dict[str, Dict[str, List[int]]] = {}  # session -> {".json"/".jsonl": [mtime_ns, size]}
+        for dirpath, dirnames, filenames in os.walk(self.memory_dir):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]  # not our own segments
+            for name in filenames:
+                base, ext = os.path.splitext(name)
+                if ext not in (".json", ".jsonl"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirpath, name))
+                except FileNotFoundError:
+                    continue  # snapshot replaced or journal folded in meanwhile
+                session = os.path.relpath(os.path.join(dirpath, base), self.memory_dir)
+                stamps.setdefault(session, {})[ext] = [stat.st_mtime_ns, stat.st_size]
+
+        for session, stamp in stamps.items():
+            known = self.sessions.get(session)
+            if known and known["stamp"] == stamp:
+                continue
+            items = self._read_session(session)
+            self._remove_session(session)
+            self._add_session(session, stamp, items)
+            self._write_segment(session, stamp, items)
+
+        for session in [s for s in self.sessions if s not in stamps]:
+            self._remove_session(session)
+            try:
+                os.remove(self._segment_path(session))
+            except FileNotFoundError:
+                pass
+
+    def search(self, query: str) -> List[Dict]:
+        """Return the items that contain every query term, ranked by BM25 score (best first)."""
+        self.refresh()
+        n_docs = len(self.docs)
+        if not n_docs:
+            return []
+        avg_length = self.total_length / n_docs
+
+        terms = set(self.tokenize(query))
+        term_postings = [self.postings.get(term, {}) for term in terms]
+        matching = set(self.docs) if not term_postings else set.intersection(*(set(p) for p in term_postings))
+        scores: Dict[str, float] = {doc_id: 0.0 for doc_id in matching}
+        for postings in term_postings:
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id in matching:
+                tf = postings[doc_id]
+                norm = self.K1 * (1 - self.B + self.B * self.docs[doc_id]["length"] / avg_length)
+                scores[doc_id] += idf * tf * (self.K1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+        return [
+            {
+                "user_query": self.docs[doc_id]["user_query"],
+                "final_answer": self.docs[doc_id]["final_answer"],
+                "timestamp": self.docs[doc_id]["timestamp"],
+                "intent": self.docs[doc_id]["intent"],
+                "score": round(score, 4),
+            }
+            for doc_id, score in ranked
+        ]
+
 # Initialize global memory store
 memory_store = MemoryStore()
+memory_index = MemoryIndex(memory_store.memory_dir)
+
+def read_session_items(base_path: str) -> List[Dict]:
+    """
+    Items of the session at base_path (no extension): the .json snapshot plus the .jsonl
+    journal replayed on top, as MemoryManager.load does. A running session exists only
+    as its journal until close().
+    """
+    items = []
+    if os.path.exists(base_path + ".json"):
+        with open(base_path + ".json", "r", encoding="utf-8") as f:
+            items = json.load(f)
+    if os.path.exists(base_path + ".jsonl"):
+        with open(base_path + ".jsonl", "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # blank or torn record
+                if record.get("index", len(items)) < len(items):
+                    items[record["index"]] = record["item"]
+                else:
+                    items.append(record["item"])
+    return items
 
 def handle_shutdown(signum, frame):
     """Global shutdown handler"""
@@ -139,20 +327,16 @@ async def get_current_conversations(input: Dict) -> Dict[str, Any]:
         if not os.path.exists(day_path):
             return {"error": "No sessions found for today"}
             
-        # Get most recent session file
-        session_files = [f for f in os.listdir(day_path) if f.endswith('.json')]
-        if not session_files:
+        # Get most recent session (snapshot, journal, or both)
+        sessions = {os.path.splitext(f)[0] for f in os.listdir(day_path) if f.endswith(('.json', '.jsonl'))}
+        if not sessions:
             return {"error": "No session files found"}
             
-        latest_file = sorted(session_files)[-1]  # Get most recent
-        file_path = os.path.join(day_path, latest_file)
-        
-        # Read and return contents
-        with open(file_path, 'r') as f:
-            data = json.load(f)
+        latest_session = sorted(sessions)[-1]  # Get most recent
+        data = read_session_items(os.path.join(day_path, latest_session))
             
         return {"result": {
-                    "session_id": latest_file.replace(".json", ""),
+                    "session_id": latest_session,
                     "interactions": [
                         item for item in data 
                         if item.get("type") != "run_metadata"
@@ -166,52 +350,27 @@ async def get_current_conversations(input: Dict) -> Dict[str, Any]:
 async def search_historical_conversations(input: SearchInput) -> Dict[str, Any]:
     """Search conversation memory between user and YOU. Usage: input={"input": {"query": "anmol singh"}} result = await mcp.call_tool('search_historical_conversations', input)"""
     try:
-        all_memories = memory_store._list_all_memories()
-        search_terms = input.query.lower().split()
-        
-        matches = []
-        for memory in all_memories:
-            # Only search in user query, final answer, and intent
-            memory_content = " ".join([
-                str(memory.get("user_query", "")),
-                str(memory.get("final_answer", "")),
-                str(memory.get("intent", ""))
-            ]).lower()
-            
-            if all(term in memory_content for term in search_terms):
-                # Only keep fields we want to return
-                matches.append({
-                    "user_query": memory.get("user_query", ""),
-                    "final_answer": memory.get("final_answer", ""),
-                    "timestamp": memory.get("timestamp", ""),
-                    "intent": memory.get("intent", "")
-                })
-
-        # Sort by timestamp (most recent last)
-        matches.sort(key=lambda x: x.get("timestamp", ""), reverse=False)
-        
-        # Count total words in matches
+        matches = memory_index.search(input.query)
+
+        # Keep the best-ranked matches within the word budget
         total_words = 0
         filtered_matches = []
         WORD_LIMIT = 10000
-        
+
         for match in matches:
             match_text = " ".join([
                 str(match.get("user_query", "")),
                 str(match.get("final_answer", ""))
             ])
             words_in_match = len(match_text.split())
-            
+
             if total_words + words_in_match <= WORD_LIMIT:
                 filtered_matches.append(match)
                 total_words += words_in_match
             else:
                 break
-        
-        return {"result": {
-                    "status": "error",
-                    "message": str(e)
-                }}
+
+        return {"result": filtered_matches}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
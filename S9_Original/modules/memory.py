@@ -29,14 +29,29 @@ class MemoryItem(BaseModel):
     metadata: Optional[dict] = {}  # ✅ ADD THIS LINE BACK
 
 
+FSYNC_EVERY = 20          # journal records written between fsyncs
+FSYNC_INTERVAL = 2.0      # ...or seconds since the last fsync, whichever comes first
+
+
 class MemoryManager:
-    """Manages session memory (read/write/append)."""
+    """
+    Manages session memory (read/write/append).
+    Items are appended to a per-session JSON Lines journal (O(1) per add) and folded
+    into the JSON snapshot by save()/close(); load() replays snapshot + journal.
+    Every record carries the position of its item, so replaying a journal that a crash
+    left behind after it was already folded into the snapshot rewrites the same items
+    instead of appending them twice.
+    """
 
     def __init__(self, session_id: str, memory_dir: str = "memory"):
         self.session_id = session_id
         self.memory_dir = memory_dir
         self.memory_path = os.path.join('memory', session_id.split('-')[0], session_id.split('-')[1], session_id.split('-')[2], f'session-{session_id}.json')
+        self.journal_path = self.memory_path[:-len(".json")] + ".jsonl"
         self.items: List[MemoryItem] = []
+        self._journal = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
 
         if not os.path.exists(self.memory_dir):
             os.makedirs(self.memory_dir)
@@ -44,23 +59,73 @@ class MemoryManager:
         self.load()
 
     def load(self):
+        self.items = []
         if os.path.exists(self.memory_path):
             with open(self.memory_path, "r", encoding="utf-8") as f:
                 raw = json.load(f)
                 self.items = [MemoryItem(**item) for item in raw]
-        else:
-            self.items = []
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        log("memory", f"⚠️ Ignoring torn journal record in {self.journal_path}")
+                        continue
+                    item = MemoryItem(**record["item"])
+                    if record.get("index", len(self.items)) < len(self.items):
+                        self.items[record["index"]] = item
+                    else:
+                        self.items.append(item)
+
+    def _append(self, record: dict):
+        if self._journal is None:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+            if self._journal.tell() > 0:
+                self._journal.write("\n")  # terminate a record torn by an earlier crash
+        self._journal.write(json.dumps(record) + "\n")
+        self._journal.flush()
+        self._unsynced += 1
+        if self._unsynced >= FSYNC_EVERY or time.monotonic() - self._last_sync >= FSYNC_INTERVAL:
+            self._sync()
+
+    def _sync(self):
+        if self._journal is not None and self._unsynced:
+            os.fsync(self._journal.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
 
     def save(self):
+        """Write a compacted snapshot of all items and reset the journal."""
         # Before opening the file for writing
         os.makedirs(os.path.dirname(self.memory_path), exist_ok=True)
-        with open(self.memory_path, "w", encoding="utf-8") as f:
+        tmp_path = self.memory_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
             raw = [item.dict() for item in self.items]
             json.dump(raw, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.memory_path)
+
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._unsynced = 0
+
+    def close(self):
+        """Compact the journal into the snapshot; call when the run is over."""
+        self._sync()
+        self.save()
 
     def add(self, item: MemoryItem):
         self.items.append(item)
-        self.save()
+        self._append({"op": "add", "index": len(self.items) - 1, "item": item.dict()})
 
     def add_tool_call(
         self, tool_name: str, tool_args: dict, tags: Optional[List[str]] = None
@@ -117,11 +182,12 @@ class MemoryManager:
         """Patch last tool call or output for a given tool with success=True/False."""
 
         # Search backwards for latest matching tool call/output
-        for item in reversed(self.items):
+        for index in range(len(self.items) - 1, -1, -1):
+            item = self.items[index]
             if item.tool_name == tool_name and item.type in {"tool_call", "tool_output"}:
                 item.success = success
                 log("memory", f"✅ Marked {tool_name} as success={success}")
-                self.save()
+                self._append({"op": "set", "index": index, "item": item.dict()})
                 return
 
         log("memory", f"⚠️ Tried to mark {tool_name} as success={success} but no matching memory found.")
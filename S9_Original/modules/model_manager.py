@@ -1,10 +1,14 @@
 import os
 import json
 import yaml
-import requests
+import asyncio
+import httpx
+from contextlib import aclosing
 from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
 from google import genai
 from dotenv import load_dotenv
+from modules.llm_cache import ResponseCache
 
 load_dotenv()
 
@@ -12,7 +16,17 @@ ROOT = Path(__file__).parent.parent
 MODELS_JSON = ROOT / "config" / "models.json"
 PROFILE_YAML = ROOT / "config" / "profiles.yaml"
 
+DEFAULT_MAX_CONCURRENCY = {"gemini": 8, "ollama": 2}  # in-flight requests per backend
+HTTP_TIMEOUT = httpx.Timeout(300.0, connect=10.0)      # local models can be slow to answer
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0)
+
 class ModelManager:
+    # Shared by every ModelManager instance (perception, decision, ...) so they reuse connections
+    _http_client: Optional[httpx.AsyncClient] = None
+    _gemini_clients: Dict[str, genai.Client] = {}
+    _semaphores: Dict[str, asyncio.Semaphore] = {}
+    _response_cache: Optional[ResponseCache] = None
+
     def __init__(self):
         self.config = json.loads(MODELS_JSON.read_text())
         self.profile = yaml.safe_load(PROFILE_YAML.read_text())
@@ -23,22 +37,124 @@ class ModelManager:
 
         # ✅ Gemini initialization (your style)
         if self.model_type == "gemini":
-            api_key = os.getenv("GEMINI_API_KEY")
-            self.client = genai.Client(api_key=api_key)
+            api_key = os.getenv(self.model_info.get("api_key_env", "GEMINI_API_KEY"))
+            if api_key not in ModelManager._gemini_clients:
+                ModelManager._gemini_clients[api_key] = genai.Client(api_key=api_key)
+            self.client = ModelManager._gemini_clients[api_key]
+
+        self.cache = self._get_response_cache(self.profile["llm"].get("cache") or {})
+
+    @classmethod
+    def _get_response_cache(cls, cache_config: dict) -> Optional[ResponseCache]:
+        """One response cache shared by all instances; None when disabled in profiles.yaml."""
+        if not cache_config.get("enabled", False):
+            return None
+        if cls._response_cache is None:
+            sqlite_path = cache_config.get("sqlite_path")
+            cls._response_cache = ResponseCache(
+                max_entries=cache_config.get("max_entries", 256),
+                ttl=cache_config.get("ttl_seconds", 3600),
+                sqlite_path=str(ROOT / sqlite_path) if sqlite_path else None,
+                max_persistent_entries=cache_config.get("max_persistent_entries", 5000),
+            )
+        return cls._response_cache
+
+    def cache_stats(self) -> dict:
+        return dict(self.cache.stats) if self.cache else {}
+
+    @classmethod
+    def http_client(cls) -> httpx.AsyncClient:
+        """Shared keep-alive HTTP client for local (Ollama) backends."""
+        if cls._http_client is None or cls._http_client.is_closed:
+            cls._http_client = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+        return cls._http_client
+
+    @classmethod
+    async def aclose(cls):
+        if cls._http_client is not None and not cls._http_client.is_closed:
+            await cls._http_client.aclose()
+        cls._http_client = None
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self.model_type not in ModelManager._semaphores:
+            limit = self.model_info.get("max_concurrency", DEFAULT_MAX_CONCURRENCY.get(self.model_type, 4))
+            ModelManager._semaphores[self.model_type] = asyncio.Semaphore(limit)
+        return ModelManager._semaphores[self.model_type]
+
+    async def generate_text(self, prompt: str, use_cache: bool = True, refresh_cache: bool = False, **params) -> str:
+        """
+        Generate text for `prompt`. Extra keyword args are passed to the backend as
+        generation parameters (e.g. temperature) and are part of the cache key.
+        use_cache=False bypasses the response cache; refresh_cache=True skips the
+        lookup but still stores the fresh response.
+        """
+        key = self._cache_key(prompt, params) if use_cache else None
+        if key is not None and not refresh_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
 
-    async def generate_text(self, prompt: str) -> str:
         if self.model_type == "gemini":
-            return self._gemini_generate(prompt)
+            async with self._semaphore():
+                text = await self._gemini_generate(prompt, params)
 
         elif self.model_type == "ollama":
-            return self._ollama_generate(prompt)
+            async with self._semaphore():
+                text = await self._ollama_generate(prompt, params)
 
-        raise NotImplementedError(f"Unsupported model type: {self.model_type}")
+        else:
+            raise NotImplementedError(f"Unsupported model type: {self.model_type}")
 
-    def _gemini_generate(self, prompt: str) -> str:
-        response = self.client.models.generate_content(
+        if key is not None and text:
+            self.cache.put(key, text)
+        return text
+
+    async def stream_text(self, prompt: str, use_cache: bool = True, refresh_cache: bool = False, **params) -> AsyncIterator[str]:
+        """
+        Yield the response to `prompt` as text chunks arrive. A cache hit is yielded
+        as a single chunk. The response is cached only if the stream is read to the
+        end; callers that stop early can store what they kept with remember().
+        """
+        key = self._cache_key(prompt, params) if use_cache else None
+        if key is not None and not refresh_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        if self.model_type == "gemini":
+            chunks = self._gemini_stream(prompt, params)
+        elif self.model_type == "ollama":
+            chunks = self._ollama_stream(prompt, params)
+        else:
+            raise NotImplementedError(f"Unsupported model type: {self.model_type}")
+
+        parts = []
+        async with self._semaphore(), aclosing(chunks):
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+
+        text = "".join(parts).strip()
+        if key is not None and text:
+            self.cache.put(key, text)
+
+    def remember(self, prompt: str, text: str, **params):
+        """Store a response obtained outside generate_text() (e.g. a truncated stream)."""
+        key = self._cache_key(prompt, params)
+        if key is not None and text:
+            self.cache.put(key, text)
+
+    def _cache_key(self, prompt: str, params: dict) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return ResponseCache.make_key(f"{self.model_type}:{self.model_info['model']}", prompt, params)
+
+    async def _gemini_generate(self, prompt: str, params: Optional[dict] = None) -> str:
+        response = await self.client.aio.models.generate_content(
             model=self.model_info["model"],
-            contents=prompt
+            contents=prompt,
+            config=params or None
         )
 
         # ✅ Safely extract response text
@@ -50,10 +166,35 @@ class ModelManager:
             except Exception:
                 return str(response)
 
-    def _ollama_generate(self, prompt: str) -> str:
-        response = requests.post(
-            self.model_info["url"]["generate"],
-            json={"model": self.model_info["model"], "prompt": prompt, "stream": False}
-        )
+    async def _ollama_generate(self, prompt: str, params: Optional[dict] = None) -> str:
+        payload = {"model": self.model_info["model"], "prompt": prompt, "stream": False}
+        if params:
+            payload["options"] = params
+        response = await self.http_client().post(self.model_info["url"]["generate"], json=payload)
         response.raise_for_status()
         return response.json()["response"].strip()
+
+    async def _gemini_stream(self, prompt: str, params: Optional[dict] = None) -> AsyncIterator[str]:
+        stream = await self.client.aio.models.generate_content_stream(
+            model=self.model_info["model"],
+            contents=prompt,
+            config=params or None
+        )
+        async for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+
+    async def _ollama_stream(self, prompt: str, params: Optional[dict] = None) -> AsyncIterator[str]:
+        payload = {"model": self.model_info["model"], "prompt": prompt, "stream": True}
+        if params:
+            payload["options"] = params
+        async with self.http_client().stream("POST", self.model_info["url"]["generate"], json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("response"):
+                    yield data["response"]
+                if data.get("done"):
+                    break
@@ -29,6 +29,7 @@ class PerceptionResult(BaseModel):
     tool_hint: Optional[str] = None
     tags: List[str] = []
     selected_servers: List[str] = []  # 🆕 NEW field
+    fallback: bool = False  # perception failed; every server is selected
 
 async def extract_perception(user_input: str, mcp_server_descriptions: dict) -> PerceptionResult:
     """
@@ -75,7 +76,8 @@ async def extract_perception(user_input: str, mcp_server_descriptions: dict) ->
             entities=[],
             tool_hint=None,
             tags=[],
-            selected_servers=list(mcp_server_descriptions.keys())
+            selected_servers=list(mcp_server_descriptions.keys()),
+            fallback=True
         )
 
 
@@ -0,0 +1,51 @@
+# reranker.py
+
+import numpy as np
+from typing import Callable, Dict, List, Optional
+
+from lexical_index import LexicalIndex
+
+DEFAULT_WEIGHTS = {
+    "semantic": 0.5,   # exact cosine between query and chunk embeddings (no quantization error)
+    "coverage": 0.35,  # idf-weighted share of the query's terms the chunk contains
+    "phrase": 0.15,    # share of the query's word pairs the chunk contains in order
+}
+
+
+def term_matrix(terms: List[str], docs_tokens: List[List[str]]) -> np.ndarray:
+    """(n_docs, n_terms) count of each query term in each document."""
+    column = {term: i for i, term in enumerate(terms)}
+    counts = np.zeros((len(docs_tokens), len(terms)), dtype=np.float32)
+    for row, tokens in enumerate(docs_tokens):
+        hits = [column[token] for token in tokens if token in column]
+        if hits:
+            counts[row] = np.bincount(hits, minlength=len(terms))
+    return counts
+
+
+def phrase_overlap(query_tokens: List[str], docs_tokens: List[List[str]]) -> np.ndarray:
+    bigrams = set(zip(query_tokens, query_tokens[1:]))
+    if not bigrams:
+        return np.zeros(len(docs_tokens), dtype=np.float32)
+    return np.array([len(bigrams & set(zip(tokens, tokens[1:]))) / len(bigrams) for tokens in docs_tokens],
+                    dtype=np.float32)
+
+
+def rerank_scores(query: str, query_vec: np.ndarray, texts: List[str], vectors: np.ndarray,
+                  idf: Callable[[List[str]], np.ndarray], weights: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """
+    Score candidates for a query as a weighted sum of exact cosine, query-term coverage
+    and phrase overlap. `vectors` and `query_vec` must be unit length.
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    query_tokens = LexicalIndex.tokenize(query)
+    terms = list(dict.fromkeys(query_tokens))
+    docs_tokens = [LexicalIndex.tokenize(text) for text in texts]
+
+    semantic = vectors @ query_vec
+    coverage = np.zeros(len(texts), dtype=np.float32)
+    if terms:
+        term_weights = idf(terms)
+        coverage = (term_matrix(terms, docs_tokens) > 0) @ term_weights / max(float(term_weights.sum()), 1e-9)
+    phrase = phrase_overlap(query_tokens, docs_tokens)
+    return weights["semantic"] * semantic + weights["coverage"] * coverage + weights["phrase"] * phrase
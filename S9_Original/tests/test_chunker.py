@@ -0,0 +1,23 @@
+from chunker import Block, _split_long
+
+
+def test_overlong_table_line_is_split_once():
+    line = "| " + " ".join(f"w{i}" for i in range(25))
+    table = Block("table", "| a | b |\n" + line)
+    pieces = _split_long(table, max_words=10)
+    words = [word for piece in pieces for word in piece.text.split()]
+    assert words == table.text.split()
+    assert all(piece.words <= 10 for piece in pieces)
+
+
+def test_overlong_list_item_is_split_once():
+    item = "- " + " ".join(f"w{i}" for i in range(23))
+    pieces = _split_long(Block("list", "- short item\n" + item), max_words=8)
+    words = [word for piece in pieces for word in piece.text.split()]
+    assert words == ("- short item\n" + item).split()
+    assert all(piece.words <= 8 for piece in pieces)
+
+
+def test_short_lines_keep_their_formatting():
+    text = "| a | b |\n|---|---|\n| 1 | 2 |"
+    assert [piece.text for piece in _split_long(Block("table", text * 4), max_words=12)][0].startswith("| a | b |\n|---|")